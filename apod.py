@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from http import HTTPStatus
+from typing import Dict, Optional
+
+import httpx
+
+import metrics
+
+apod_logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+)
+
+
+class CircuitBreaker:
+    """Размыкается после failure_threshold неудачных запросов подряд.
+
+    Пока цепь разомкнута, запросы к API не выполняются; замыкает её
+    фоновая проба (ApodClient._probe).
+    """
+
+    def __init__(self, failure_threshold: int = 5, probe_interval: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.is_open = False
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self) -> bool:
+        """Учёт ошибки; True, если цепь только что разомкнулась."""
+        self.failures += 1
+        if self.is_open or self.failures < self.failure_threshold:
+            return False
+        self.is_open = True
+        metrics.set_circuit_open(True)
+        return True
+
+    def close(self):
+        self.failures = 0
+        self.is_open = False
+        metrics.set_circuit_open(False)
+
+
+class ApodClient:
+    """Асинхронный клиент APOD API.
+
+    Держит один пул HTTP/2-соединений, повторяет запрос с экспоненциальной
+    задержкой и схлопывает одновременные одинаковые запросы в один.
+    При недоступности API размыкает цепь (CircuitBreaker) и отвечает None
+    без сетевых запросов, пока фоновая проба не увидит, что API ожил.
+    """
+
+    def __init__(self, endpoint: str, token: str, timeout: float = 10.0,
+                 retries: int = 3, backoff: float = 0.5, max_connections: int = 10,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.endpoint = endpoint
+        self.token = token
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = httpx.Timeout(timeout, connect=5.0)
+        self.limits = httpx.Limits(max_connections=max_connections)
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_available(self) -> bool:
+        return not self.breaker.is_open
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True, timeout=self.timeout, limits=self.limits
+            )
+        return self._client
+
+    async def fetch(self, **params):
+        """Запрос к APOD API; одинаковые параллельные запросы ждут первый.
+
+        Запрос выполняется в отдельной задаче: отмена одного из ожидающих
+        не прерывает его для остальных.
+        """
+        key = tuple(sorted(params.items()))
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def fetch_date(self, date: str) -> Optional[dict]:
+        return await self.fetch(date=date, thumbs='true')
+
+    async def _fetch(self, params: dict):
+        params = {'api_key': self.token, **params}
+        for attempt in range(self.retries + 1):
+            if self.breaker.is_open:
+                return None
+            started = time.perf_counter()
+            try:
+                response = await self.client.get(self.endpoint, params=params)
+            except httpx.TransportError as err:
+                metrics.observe_apod('error', time.perf_counter() - started)
+                apod_logger.warning('Ошибка соединения с APOD API: %r', err)
+            else:
+                metrics.observe_apod(response.status_code, time.perf_counter() - started)
+                if response.status_code == HTTPStatus.OK:
+                    self.breaker.record_success()
+                    return response.json()
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    apod_logger.error(
+                        'APOD API вернул %s для %s', response.status_code, params.get('date')
+                    )
+                    return None
+                apod_logger.warning('APOD API вернул %s, повтор...', response.status_code)
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        if self.breaker.record_failure():
+            apod_logger.error('APOD API недоступен, цепь разомкнута.')
+            self._probe_task = asyncio.ensure_future(self._probe())
+        return None
+
+    async def _probe(self):
+        """Периодическая проверка API, пока цепь разомкнута."""
+        while self.breaker.is_open:
+            await asyncio.sleep(self.breaker.probe_interval)
+            try:
+                response = await self.client.get(self.endpoint, params={'api_key': self.token})
+            except httpx.TransportError:
+                continue
+            if response.status_code not in RETRY_STATUSES:
+                self.breaker.close()
+                apod_logger.info('APOD API снова доступен, цепь замкнута.')
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,69 @@
+"""Загрузка архива APOD в локальное хранилище диапазонными запросами.
+
+Запуск вручную: python backfill.py [--full]
+"""
+import asyncio
+import logging
+import sys
+from datetime import date, datetime, timedelta
+
+import database as db
+from apod import ApodClient
+from cache import ApodCache
+
+backfill_logger = logging.getLogger(__name__)
+
+BATCH_DAYS = 100
+
+
+async def backfill(client: ApodClient, cache: ApodCache, start: date, end: date,
+                   batch_days: int = BATCH_DAYS) -> int:
+    """Загрузка записей APOD за [start, end] пачками по batch_days дней."""
+    saved = 0
+    while start <= end:
+        batch_end = min(start + timedelta(days=batch_days - 1), end)
+        responses = await client.fetch(
+            start_date=start.strftime('%Y-%m-%d'),
+            end_date=batch_end.strftime('%Y-%m-%d'),
+            thumbs='true'
+        )
+        if responses is None:
+            backfill_logger.error('Не удалось загрузить APOD за %s - %s.', start, batch_end)
+            break
+        saved += await cache.put_many(responses)
+        backfill_logger.info('Загружен APOD за %s - %s.', start, batch_end)
+        start = batch_end + timedelta(days=1)
+    return saved
+
+
+async def backfill_missing(client: ApodClient, cache: ApodCache, first_date: str,
+                           full: bool = False) -> int:
+    """Догрузка архива со дня, следующего за последней сохранённой датой."""
+    last_date = None if full else await db.Apod.last_date()
+    if last_date:
+        start = last_date + timedelta(days=1)
+    else:
+        start = datetime.strptime(first_date, '%Y-%m-%d').date()
+    end = datetime.strptime(cache.today(), '%Y-%m-%d').date()
+    return await backfill(client, cache, start, end)
+
+
+if __name__ == '__main__':
+    # bot импортирует этот модуль, поэтому импорт только при ручном запуске.
+    from bot import APOD_FIRST_DATE, apod_cache, apod_client
+    from bot_logger import logger_config
+
+    logger_config()
+
+    async def main():
+        try:
+            await db.wait_for_db()
+            saved = await backfill_missing(
+                apod_client, apod_cache, APOD_FIRST_DATE, full='--full' in sys.argv
+            )
+            backfill_logger.info('Сохранено записей APOD: %s.', saved)
+        finally:
+            await apod_client.close()
+            await db.dispose()
+
+    asyncio.run(main())
@@ -1,259 +1,663 @@
+import asyncio
 import logging
 import os
-import re
-from datetime import datetime
-from http import HTTPStatus
-from typing import List, Tuple
-
-import psycopg2
-import requests
-from dotenv import load_dotenv
-from psycopg2.errors import OperationalError
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from pytz import timezone
-from telegram import InputMediaPhoto, Update
-from telegram.ext import (ApplicationBuilder, CallbackQueryHandler,
+import sys
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
+from typing import List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from telegram import ChatMember, InputMediaPhoto, Message, Update
+from telegram.error import BadRequest
+from telegram.ext import (AIORateLimiter, ApplicationBuilder,
+                          CallbackQueryHandler, ChatMemberHandler,
                           CommandHandler, ContextTypes, MessageHandler,
                           filters)
 
+import callbacks as cb
 import database as db
 import keyboards as kb
+import metrics
+from apod import ApodClient
+from backfill import backfill_missing
+from broadcast import Broadcaster
 from bot_logger import logger_config
-from utils import binary_search
-
-load_dotenv()
+from cache import ApodCache, ApodEntry, MediaCache, UserStateCache
+from concurrency import UserLocks
+from media import MediaStore
+from prefetch import Prefetcher
+from settings import (APOD_DAILY_JOB_TIME, APOD_ERROR_IMAGE_URL,
+                      APOD_FIRST_DATE, APOD_LRU_SIZE, APOD_TODAY_TTL, BOT_MODE,
+                      BOT_TOKEN, BROADCAST_BATCH_SIZE, BROADCAST_RATE,
+                      BROADCAST_TIME, CAPTION_MODE, CONCURRENT_UPDATES,
+                      ENDPOINT, MAX_CAPTION_SIZE, MAX_MESSAGE_SIZE,
+                      MAX_PENDING_UPDATES, MEDIA_CACHE_DIR, MEDIA_MAX_SIDE,
+                      METRICS_ADDR, METRICS_PORT, NASA_API_TZ, NASA_TOKEN,
+                      PREFETCH_CONCURRENCY, SEARCH_RESULTS_LIMIT,
+                      STATS_REFRESH_INTERVAL, TELEGRAM_API_URL,
+                      TELEGRAM_FILE_URL, TOP_PICTURES_LIMIT,
+                      USER_STATE_LRU_SIZE, USER_STATE_TTL, WEBHOOK_LISTEN,
+                      WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
 
 bot_logger = logging.getLogger(__name__)
 
-ENDPOINT = 'https://api.nasa.gov/planetary/apod?api_key={}&date={}'
-NASA_TOKEN = os.getenv('NASA_TOKEN')
-BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN_PROD')
-NASA_API_TZ = timezone('US/Eastern')
-MAX_CAPTION_SIZE = 1024
-APOD_FIRST_DATE = '1995-06-16'
-
-DB_DIALECT  = os.getenv('DB_DIALECT')
-DB_HOSTNAME = os.getenv('DB_HOSTNAME')
-DB_USERNAME = os.getenv('POSTGRES_USER')
-DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-DB_DATABASE = os.getenv('DB_DATABASE')
-DB_PORT = os.getenv('DB_PORT')
-DB_URL = "%s://%s:%s@%s:%s/%s" % (
-    DB_DIALECT,
-    DB_USERNAME,
-    DB_PASSWORD,
-    DB_HOSTNAME,
-    DB_PORT,
-    DB_DATABASE
+apod_cache = ApodCache(
+    NASA_API_TZ, APOD_TODAY_TTL, APOD_LRU_SIZE, MAX_CAPTION_SIZE, MAX_MESSAGE_SIZE
 )
+apod_client = ApodClient(ENDPOINT, NASA_TOKEN)
+media_cache = MediaCache(APOD_LRU_SIZE)
+media_store = MediaStore(MEDIA_CACHE_DIR, MEDIA_MAX_SIDE) if MEDIA_CACHE_DIR else None
+user_states = UserStateCache(USER_STATE_LRU_SIZE, USER_STATE_TTL)
+user_locks = UserLocks(CONCURRENT_UPDATES)
+revalidating = {}
 
+@metrics.track_handler
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if db.User(user).user_id == 214733890:
-        bot_logger.info(f'Админ {user.username} в здании!')
+        bot_logger.info('Админ %s в здании!', user.username)
     else:
         await context.bot.send_message(
             update.effective_chat.id, 'Нет прав!', reply_markup=kb.build_return_to_menu_kb()
         )
         return
-    users = db.User.get_all(limit=10)
-    favs = db.Favorite.get_all(limit=10)
-    resp = '\n'.join(
-        [f'{user[0].first_name} {user[0].last_name} - {user[0].username}' for user in users]
-    )
-    resp_favs = '\n'.join(
-        [f'{str(fav[0].id)}: {fav[0].user_id} - {fav[0].pic_date}' for fav in favs]
-    )
-    await context.bot.send_message(
-        update.effective_chat.id, resp
-    )
+    summary = await db.Stats.summary()
+    if summary is None:
+        await context.bot.send_message(
+            update.effective_chat.id, 'Статистика ещё не посчитана.',
+            reply_markup=kb.build_return_to_menu_kb()
+        )
+        return
+    active = await db.Stats.daily_active_users(days=7)
+    top = await db.Stats.top_pictures(limit=5)
+    top_users = await db.Stats.top_users(limit=5)
+    lines = [
+        f'Пользователей: {summary.users} (не заблокировали бота: {summary.active_users}, '
+        f'подписчиков: {summary.subscribers})',
+        f'Избранного: {summary.favs} у {summary.users_with_favs} пользователей',
+        '',
+        'Активные пользователи по дням:',
+        *[f'{day:%d.%m}: {users}' for day, users in active],
+        '',
+        'Популярные картинки:',
+        *[f'{day:%d.%m.%Y} {title or ""} - {favs}' for day, title, favs in top],
+        '',
+        'Больше всего избранного:',
+        *[f'{user_id} - {favs}' for user_id, favs in top_users],
+        '',
+        f'Обновлено: {summary.refreshed_at:%d.%m.%Y %H:%M}',
+    ]
     await context.bot.send_message(
-        update.effective_chat.id, resp_favs, reply_markup=kb.build_return_to_menu_kb()
+        update.effective_chat.id, '\n'.join(lines), reply_markup=kb.build_return_to_menu_kb()
     )
 
+@metrics.track_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало чата, регистрация новых пользователей."""
     user = db.User(update.effective_user)
-    if user.exists():
-        bot_logger.info(f'Вошёл существующий пользователь (id = {user.user_id})')
+    state = user_states.get(user.user_id)
+    if state.registered:
+        bot_logger.info('Вошёл существующий пользователь (id = %s)', user.user_id)
+    elif await user.upsert():
+        bot_logger.info('Новый пользователь (id = %s)', user.user_id)
+        state.set_favs([])
     else:
-        user.commit()
-        bot_logger.info(f'Новый пользователь (id = {user.user_id})')
-
-    date = datetime.now(tz=NASA_API_TZ).strftime('%Y-%m-%d')
-    user_fav = user.get_last_fav()
-    if user_fav:
-        bot_logger.debug(f'У пользователя есть Избранное.')
-        fav_date = f'fav: {user_fav[0].pic_date}'
-    else:
-        fav_date = None
+        bot_logger.info('Вошёл существующий пользователь (id = %s)', user.user_id)
+    state.registered = True
+
+    today = datetime.now(tz=NASA_API_TZ).date()
+    await user_states.load_favs(user.user_id)
+    fav_date = state.last_fav()
+    if fav_date:
+        bot_logger.debug('У пользователя есть Избранное.')
 
     message = (
         f'Привет, {update.effective_user.first_name}!'
         '\nПосмотрим на звёзды сегодня?'
+        '\n\nЕжедневная рассылка: /subscribe, отписаться: /unsubscribe'
+        '\nАрхив: /search <слова>, /random, /date ГГГГ-ММ-ДД'
     )    
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text=message,
-        reply_markup=kb.get_start_keyboard(date, fav_date)
+        reply_markup=kb.get_start_keyboard(today, fav_date)
     )
 
+@metrics.track_handler
+async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE, day=None):
+    """Возврат в главное меню."""
+    await update.callback_query.delete_message()
+    await send_followups(context, update.effective_chat.id, [])
+    await start(update, context)
+
+@metrics.track_handler
 async def button_dispatcher(update: Update, context):
     """Перенаправление на нужный обработчик исходя из текста запроса."""
     query_data = update.callback_query.data
-    bot_logger.debug(f'Запрос: {query_data}')
-    if query_data.startswith('fav: '):
-        await favs(update, context)
-    if query_data.startswith('favs_add'):
-        await favs_add(update, context)
-    elif query_data == 'menu':
-        await update.callback_query.delete_message()
-        await start(update, context)
-    elif re.match('^(\d\d\d\d-\d\d-\d\d)$', query_data): # parse date exist
-        await get_img(update, context)
-    else:
+    bot_logger.debug('Запрос: %s', query_data)
+    kind, day = cb.decode(query_data)
+    route = CALLBACK_ROUTES.get(kind)
+    if route is None:
         bot_logger.debug('Необознанный запрос!')
         return
+    await route(update, context, day)
+
+async def refresh_apod(date: str, reload: bool = False) -> Optional[ApodEntry]:
+    """Запрос записи у APOD API и сохранение в кэш.
+
+    reload - сначала проверить БД: при нескольких репликах запись могла уже
+    обновить другая, и к API идёт только одна из них.
+    """
+    if reload:
+        entry = await apod_cache.reload(date)
+        if entry is not None:
+            return entry
+    response = await apod_client.fetch_date(date)
+    if response is None:
+        return None
+    entry = await apod_cache.put(response)
+    bot_logger.info('Успешно получен ответ от APOD API!')
+    return entry
+
+def revalidate_apod(date: str):
+    """Фоновое обновление устаревшей записи (stale-while-revalidate)."""
+    if date in revalidating:
+        return
+    task = asyncio.create_task(refresh_apod(date, reload=True))
+    revalidating[date] = task
+    task.add_done_callback(lambda _: revalidating.pop(date, None))
+
+async def get_api_response(date: str) -> ApodEntry:
+    """Получение ответа от APOD API (с кэшированием).
 
-def get_api_response(date: str) -> Tuple[str, List[str]]:
-    """Получение ответа от APOD API."""
-    endpoint = ENDPOINT.format(NASA_TOKEN, date)
-    response = requests.get(endpoint)
-    if response.status_code != HTTPStatus.OK:
+    Устаревшая запись за сегодня отдаётся сразу и обновляется в фоне;
+    при недоступности API отдаётся последняя сохранённая запись.
+    """
+    cached = await apod_cache.get(date, allow_stale=True)
+    if cached and apod_cache.is_fresh(cached):
+        bot_logger.debug('APOD от %s взят из кэша.', date)
+        return cached
+    if cached:
+        bot_logger.debug('APOD от %s устарел, обновляем в фоне.', date)
+        if apod_client.is_available:
+            revalidate_apod(date)
+        return cached
+    entry = await refresh_apod(date)
+    if entry is None:
         bot_logger.error('Не удалось получить данные с APOD API!')
-        image_url = 'http://lamcdn.net/lookatme.ru/post_image-image/sIaRmaFSMfrw8QJIBAa8mA-small.png'
-        captions = ['Что-то пошло не так :( Уже чиним...']
-    else:
-        response = response.json()
-        image_url = response.get('url')
-        caption = f'Картинка от {date[-2:]}.{date[-5:-3]}\n' + response.get('explanation')
-        captions = [caption[i:i+MAX_CAPTION_SIZE] for i in range(0, len(caption), MAX_CAPTION_SIZE)]
-        bot_logger.info('Успешно получен ответ от APOD API!')
-    return (image_url, captions)
+        return ApodEntry(
+            date,
+            APOD_ERROR_IMAGE_URL,
+            ['Что-то пошло не так :( Уже чиним...'],
+            datetime.now(tz=NASA_API_TZ)
+        )
+    return entry
 
+def render_apod(entry: ApodEntry) -> Tuple[Optional[str], List[str]]:
+    """Картинка для отправки (None - только текст) и части описания.
 
-async def get_img(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Получение картинок и возвращение клавиатуры-листалки."""
+    Видео отправляется превью со ссылкой в подписи, без превью - текстом со
+    ссылкой; прочие типы без url - только текстом.
+    """
+    if entry.media_type == 'image':
+        return entry.image_url, entry.captions
+    if entry.media_type != 'video' or not entry.image_url:
+        return None, entry.captions
+    link = f'🎬 Видео: {entry.image_url}'
+    first = f'{link}\n{entry.captions[0]}'
+    limit = MAX_CAPTION_SIZE if entry.thumbnail_url else MAX_MESSAGE_SIZE
+    if len(first) <= limit:
+        return entry.thumbnail_url, [first] + entry.captions[1:]
+    return entry.thumbnail_url, [link] + entry.captions
+
+async def warm_apod(date: str):
+    """Прогрев кэшей ответа APOD и file_id для даты."""
+    image_url, _ = render_apod(await get_api_response(date))
+    if image_url:
+        file_id = await media_cache.get(date, image_url)
+        if file_id is None and media_store is not None:
+            await media_store.get(image_url)
+
+async def get_photo(date: str, image_url: str) -> Tuple[Optional[str], Union[str, bytes]]:
+    """file_id (если картинка уже в Telegram) и что отправлять.
+
+    Без file_id отправляется локальная уменьшенная копия, если она включена и
+    удалась, иначе - url.
+    """
+    file_id = await media_cache.get(date, image_url)
+    if file_id:
+        return file_id, file_id
+    if media_store is not None:
+        data = await media_store.get(image_url)
+        if data is not None:
+            return None, data
+    return None, image_url
+
+prefetcher = Prefetcher(warm_apod, PREFETCH_CONCURRENCY)
+
+async def send_followups(context: ContextTypes.DEFAULT_TYPE, chat_id: int, texts: List[str]):
+    """Продолжение описания под фото.
+
+    Уже отправленные сообщения редактируются, лишние удаляются: при листании
+    под фото остаётся описание именно этой картинки.
+    """
+    sent = context.chat_data.get('apod_followups', [])
+    for message_id in sent[len(texts):]:
+        try:
+            await context.bot.delete_message(chat_id, message_id)
+        except BadRequest:
+            pass
+    followups = []
+    for i, text in enumerate(texts):
+        if i < len(sent):
+            try:
+                await context.bot.edit_message_text(text, chat_id, sent[i])
+                followups.append(sent[i])
+                continue
+            except BadRequest as err:
+                if 'not modified' in str(err):
+                    followups.append(sent[i])
+                    continue
+        message = await context.bot.send_message(chat_id, text)
+        followups.append(message.message_id)
+    context.chat_data['apod_followups'] = followups
+
+async def send_apod(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                    entry: ApodEntry, reply_markup):
+    """Отправка (или замена) записи APOD подходящим для media_type способом.
+
+    Сообщение с кнопкой редактируется, если его тип (фото/текст) не меняется,
+    иначе пересоздаётся; на команды (без кнопки) отправляется новое.
+    file_id из Telegram переиспользуется.
+    """
     query = update.callback_query
-    await query.answer()
-    date_str = query.data
-    bot_logger.info(f'Получение фото от {date_str}...')
-    # API requests may be upgraded with aiohttp: 
-    image_url, captions = get_api_response(date_str)
-    is_next, is_prev = False, False
-
-    if not date_str == datetime.now(tz=NASA_API_TZ).strftime('%Y-%m-%d'):
-        is_next = True
-    if not date_str == datetime.strptime(APOD_FIRST_DATE, '%Y-%m-%d'):
-        is_prev = True
-
-    reply_markup = kb.build_listing_keyboard(date_str, is_prev, is_next)
-
-    chat = update.effective_chat
-    if not query.message.photo:
-        await query.delete_message()
-        await context.bot.send_photo(chat.id, image_url, captions[0], reply_markup=reply_markup)
+    current = query.message if query else None
+    chat_id = update.effective_chat.id
+    image_url, captions = render_apod(entry)
+    followups = captions[1:] if CAPTION_MODE == 'full' else []
+    if image_url is None:
+        if current is not None and not current.photo:
+            try:
+                await query.edit_message_text(captions[0], reply_markup=reply_markup)
+            except BadRequest as err:
+                if 'not modified' not in str(err):
+                    raise
+        else:
+            if current is not None:
+                await query.delete_message()
+            await send_followups(context, chat_id, [])
+            await context.bot.send_message(chat_id, captions[0], reply_markup=reply_markup)
+        await send_followups(context, chat_id, followups)
+        return
+    file_id, media = await get_photo(entry.date, image_url)
+    if current is not None and current.photo:
+        message = await query.edit_message_media(
+            media=InputMediaPhoto(media, captions[0]), reply_markup=reply_markup
+        )
+    else:
+        if current is not None:
+            await query.delete_message()
+        await send_followups(context, chat_id, [])
+        message = await context.bot.send_photo(
+            chat_id, media, captions[0], reply_markup=reply_markup
+        )
+    await send_followups(context, chat_id, followups)
+    if file_id or image_url == APOD_ERROR_IMAGE_URL:
         return
-    await query.edit_message_media(media=InputMediaPhoto(image_url, captions[0]), reply_markup=reply_markup)
+    if isinstance(message, Message) and message.photo:
+        await media_cache.put(entry.date, image_url, message.photo[-1].file_id)
+        bot_logger.debug('Сохранён file_id фото от %s.', entry.date)
 
-async def favs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@metrics.track_handler
+async def get_img(update: Update, context: ContextTypes.DEFAULT_TYPE, day: date):
+    """Получение картинок и возвращение клавиатуры-листалки."""
+    await update.callback_query.answer()
+    await show_day(update, context, day)
+
+async def show_day(update: Update, context: ContextTypes.DEFAULT_TYPE, day: date):
+    """Картинка за день с клавиатурой-листалкой."""
+    date_str = day.strftime('%Y-%m-%d')
+    bot_logger.info('Получение фото от %s...', date_str)
+    entry = await get_api_response(date_str)
+    is_next = day < datetime.now(tz=NASA_API_TZ).date()
+    is_prev = day > cb.APOD_EPOCH
+
+    reply_markup = kb.build_listing_keyboard(day, is_prev, is_next, is_hd=bool(entry.hdurl))
+    await send_apod(update, context, entry, reply_markup)
+    prefetcher.schedule(update.effective_user.id, (
+        (day - timedelta(days=1)).strftime('%Y-%m-%d') if is_prev else None,
+        (day + timedelta(days=1)).strftime('%Y-%m-%d') if is_next else None,
+    ))
+
+@metrics.track_handler
+async def favs(update: Update, context: ContextTypes.DEFAULT_TYPE, day: date):
     """Получение избранных фото."""
     user = db.User(update.effective_user)
     query = update.callback_query
-    query_fav_date = query.data
     await query.answer()
-    bot_logger.info(
-        f'Запрос избранного от даты {query_fav_date} (+1/-1). User: {user}.'
-        )
-    parsed_date = re.match('fav: (\d\d\d\d-\d\d-\d\d)', query_fav_date).group(1)
-    # API requests may be upgraded with aiohttp: 
-    image_url, captions = get_api_response(parsed_date)
+    date_str = day.strftime('%Y-%m-%d')
+    bot_logger.info('Запрос избранного от даты %s (+1/-1). User: %s.', date_str, user)
+    entry = await get_api_response(date_str)
     # Generate query with favs pic_date for keyboard:
-    parsed_date = datetime.strptime(parsed_date, '%Y-%m-%d').date()
-    favs = user.get_all_favs()
-    favs_num = len(favs)
-    fav_index = binary_search(
-        favs,
-        user.get_fav_by_pic_date(parsed_date),
-        lambda x: x[0].added_date
-    )
-    next, prev = None, None
-    if fav_index == 0:
-        if fav_index + 1 < favs_num:
-            prev = favs[fav_index + 1]
-    elif fav_index == favs_num - 1:
-        next = favs[fav_index - 1]
+    state = await user_states.load_favs(user.user_id)
+    neighbours = state.fav_neighbours(day)
+    if neighbours is None:
+        # В кэше нет этой даты (например, добавлена другим процессом).
+        state.favs = None
+        neighbours = await user.get_fav_neighbours(day)
+    prev, next, favs_num = neighbours
+    reply_markup = kb.build_fav_keyboard(prev, next)
+    await send_apod(update, context, entry, reply_markup)
+    prefetcher.schedule(update.effective_user.id, (
+        prev.strftime('%Y-%m-%d') if prev else None,
+        next.strftime('%Y-%m-%d') if next else None,
+    ))
+    bot_logger.info('Запрос избранного обработан! User: %s, всего избранных: %s.', user, favs_num)
+
+@metrics.track_handler
+async def favs_add(update: Update, context: ContextTypes.DEFAULT_TYPE, day: date):
+    """Добавление в БД данных о избранных фото пользователей."""
+    query = update.callback_query
+    state = await user_states.load_favs(update.effective_user.id)
+    created = state.fav_neighbours(day) is None
+    if created:
+        if not state.registered:
+            # Пришёл через /date, /random или /search без /start: без строки
+            # в users избранное не пройдёт внешний ключ.
+            await db.User(update.effective_user).upsert()
+            state.registered = True
+        # Запись в БД - пачкой в фоне, пользователю отвечаем сразу.
+        db.write_behind.add_favorite(update.effective_user.id, day)
+        state.add_fav(day)
+        await query.answer(text='Добавлено!', show_alert=True)
+        bot_logger.info(
+            'Пользователь (%s) добавил фото от %s в избранное.', update.effective_user.id, day
+        )
     else:
-        if fav_index + 1 < favs_num:
-            prev = favs[fav_index + 1]
-        next = favs[fav_index - 1]
-    prev_date = datetime.strftime(prev[0].pic_date, '%Y-%m-%d') if prev else None
-    next_date = datetime.strftime(next[0].pic_date, '%Y-%m-%d') if next else None
-    reply_markup = kb.build_fav_keyboard(prev_date, next_date)
-
-    if not query.message.photo:
-        await query.delete_message()
-        await context.bot.send_photo(
-            update.effective_chat.id, 
-            image_url, 
-            captions[0], 
-            reply_markup=reply_markup
+        await query.answer(text='Уже в избранном!', show_alert=True)
+        bot_logger.info('Пользователь пытался добавить фото, которое уже в избранном.')
+
+@metrics.track_handler
+async def send_hd(update: Update, context: ContextTypes.DEFAULT_TYPE, day: date):
+    """Отправка картинки в полном разрешении документом."""
+    query = update.callback_query
+    entry = await get_api_response(day.strftime('%Y-%m-%d'))
+    if not entry.hdurl:
+        await query.answer(text='HD-версии нет :(', show_alert=True)
+        return
+    await query.answer()
+    chat_id = update.effective_chat.id
+    # По url Telegram принимает документом только GIF, PDF и ZIP: картинку
+    # скачиваем сами (с тем же лимитом размера, что и у MediaStore).
+    data = await media_store.download(entry.hdurl) if media_store is not None else None
+    filename = os.path.basename(urlparse(entry.hdurl).path) or f'{entry.date}.jpg'
+    try:
+        await context.bot.send_document(
+            chat_id, data if data is not None else entry.hdurl, filename=filename
+        )
+    except BadRequest as err:
+        bot_logger.warning('HD-версия от %s не отправлена: %s', entry.date, err)
+        await context.bot.send_message(chat_id, f'HD-версия: {entry.hdurl}')
+
+@metrics.track_handler
+async def top_pictures(update: Update, context: ContextTypes.DEFAULT_TYPE, day=None):
+    """Самые популярные в Избранном картинки."""
+    query = update.callback_query
+    await query.answer()
+    top = await db.Stats.top_pictures(TOP_PICTURES_LIMIT)
+    if not top:
+        await query.edit_message_text(
+            'Пока никто ничего не добавил в Избранное.', reply_markup=kb.build_return_to_menu_kb()
         )
         return
-    await query.edit_message_media(
-        media=InputMediaPhoto(image_url, captions[0]), reply_markup=reply_markup
+    await query.edit_message_text(
+        '🏆 Чаще всего добавляют в Избранное:', reply_markup=kb.build_top_keyboard(top)
     )
-    bot_logger.info(f'Запрос избранного обработан! User: {user}.')
 
-async def favs_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Добавление в БД данных о избранных фото пользователей."""
-    query = update.callback_query
-    parsed_date = re.match('^.*(\d\d\d\d-\d\d-\d\d)$', query.data).group(1)
-    fav = db.Favorite(
-        update.effective_user.id, 
-        datetime.strptime(parsed_date, '%Y-%m-%d').date()
+CALLBACK_ROUTES = {
+    cb.DAY: get_img,
+    cb.FAV: favs,
+    cb.FAV_ADD: favs_add,
+    cb.HD: send_hd,
+    cb.MENU: menu,
+    cb.TOP: top_pictures,
+}
+
+@metrics.track_handler
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск по архиву APOD: /search <слова>."""
+    words = ' '.join(context.args)
+    if not words:
+        await context.bot.send_message(
+            update.effective_chat.id, 'Что ищем? Например: /search crab nebula'
+        )
+        return
+    results = await db.Apod.search(words, SEARCH_RESULTS_LIMIT)
+    bot_logger.info('Поиск "%s": найдено %s.', words, len(results))
+    if not results:
+        await context.bot.send_message(
+            update.effective_chat.id, 'Ничего не нашлось :(', reply_markup=kb.build_return_to_menu_kb()
+        )
+        return
+    await context.bot.send_message(
+        update.effective_chat.id, f'Нашлось по запросу "{words}":',
+        reply_markup=kb.build_search_keyboard(results)
     )
-    if fav.exists():
-        await context.bot.answer_callback_query(callback_query_id=query.id, text='Уже в избранном!', show_alert=True)
-        bot_logger.info('Пользователь пытался добавить фото, которое уже в избранном.')
-    else:
-        fav.commit()
-        await context.bot.answer_callback_query(callback_query_id=query.id, text='Добавлено!', show_alert=True)
-        bot_logger.info(
-            f'Пользователь ({update.effective_user.id}) добавил фото от {parsed_date} в избранное.'
+
+@metrics.track_handler
+async def random_apod(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Случайная картинка из архива."""
+    today = datetime.now(tz=NASA_API_TZ).date()
+    day = await db.Apod.random_date(cb.APOD_EPOCH, today)
+    if day is None:
+        await context.bot.send_message(update.effective_chat.id, 'Архив ещё не загружен :(')
+        return
+    await show_day(update, context, day)
+
+@metrics.track_handler
+async def date_apod(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Картинка за дату: /date YYYY-MM-DD."""
+    today = datetime.now(tz=NASA_API_TZ).date()
+    try:
+        day = datetime.strptime(context.args[0], '%Y-%m-%d').date()
+    except (IndexError, ValueError):
+        await context.bot.send_message(update.effective_chat.id, 'Формат: /date 2004-05-16')
+        return
+    if not cb.APOD_EPOCH <= day <= today:
+        await context.bot.send_message(
+            update.effective_chat.id,
+            f'Архив APOD - с {cb.APOD_EPOCH:%d.%m.%Y} по сегодняшний день.'
         )
-    await query.answer()
+        return
+    await show_day(update, context, day)
+
+@metrics.track_handler
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подписка на ежедневную рассылку."""
+    user = db.User(update.effective_user)
+    state = user_states.get(user.user_id)
+    if not state.registered:
+        await user.upsert()
+        state.registered = True
+    await db.User.set_subscribed(user.user_id, True)
+    bot_logger.info('Пользователь (%s) подписался на рассылку.', user.user_id)
+    await context.bot.send_message(
+        update.effective_chat.id,
+        'Готово! Картинка дня будет приходить каждое утро.',
+        reply_markup=kb.build_return_to_menu_kb()
+    )
+
+@metrics.track_handler
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отписка от ежедневной рассылки."""
+    await db.User.set_subscribed(update.effective_user.id, False)
+    bot_logger.info('Пользователь (%s) отписался от рассылки.', update.effective_user.id)
+    await context.bot.send_message(
+        update.effective_chat.id,
+        'Рассылка отключена.',
+        reply_markup=kb.build_return_to_menu_kb()
+    )
+
+@metrics.track_handler
+async def chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Учёт блокировки/разблокировки бота пользователем."""
+    status = update.my_chat_member.new_chat_member.status
+    is_leave = status in (ChatMember.BANNED, ChatMember.LEFT)
+    await db.User.set_leave([update.effective_user.id], is_leave)
+    bot_logger.info('Пользователь (%s): is_leave=%s.', update.effective_user.id, is_leave)
 
+@metrics.track_handler
 async def user_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    bot_logger.info(f'Сообщение от пользователя ({update.effective_user.id}): {update.effective_message.text}')
+    bot_logger.info(
+        'Сообщение от пользователя (%s): %s',
+        update.effective_user.id, update.effective_message.text
+    )
     await context.bot.send_message(
         chat_id=update.effective_chat.id, text="Хорошо, я передам..."
     )
 
+async def daily_apod(context: ContextTypes.DEFAULT_TYPE):
+    """Догрузка новых записей APOD в локальное хранилище."""
+    saved = await backfill_missing(apod_client, apod_cache, APOD_FIRST_DATE)
+    bot_logger.info('Архив APOD обновлён, новых записей: %s.', saved)
+
+async def daily_broadcast(context: ContextTypes.DEFAULT_TYPE):
+    """Рассылка новой картинки дня подписчикам."""
+    today = datetime.now(tz=NASA_API_TZ).date()
+    entry = await get_api_response(today.strftime('%Y-%m-%d'))
+    if entry.image_url == APOD_ERROR_IMAGE_URL:
+        bot_logger.error('Рассылка отменена: нет картинки дня.')
+        return
+    # Advisory-блокировка не даст запустить рассылку одновременно, а отметка
+    # в job_runs - повторно (например, реплике с отстающими часами).
+    if not await db.JobRun.claim('daily_broadcast', entry.date):
+        bot_logger.info('Рассылка за %s уже выполнена.', entry.date)
+        return
+    image_url, captions = render_apod(entry)
+    file_id, photo = await get_photo(entry.date, image_url) if image_url else (None, None)
+    broadcaster = Broadcaster(
+        context.bot,
+        photo,
+        captions[0],
+        kb.build_listing_keyboard(today, is_prev=True, is_hd=bool(entry.hdurl)),
+        BROADCAST_RATE,
+        BROADCAST_BATCH_SIZE,
+        file_id=file_id
+    )
+    await broadcaster.run()
+    if image_url and not file_id and broadcaster.file_id:
+        await media_cache.put(entry.date, image_url, broadcaster.file_id)
+
+async def refresh_stats(context: ContextTypes.DEFAULT_TYPE):
+    """Пересчёт статистики для /admin и кнопки «Популярное»."""
+    # Реплики запускают задачу со своим сдвигом: advisory-блокировка
+    # исключает только одновременный запуск, поэтому пересчёт отмечается
+    # в job_runs - один на интервал STATS_REFRESH_INTERVAL.
+    interval = STATS_REFRESH_INTERVAL.total_seconds()
+    bucket = datetime.fromtimestamp(
+        datetime.now(timezone.utc).timestamp() // interval * interval, timezone.utc
+    )
+    if not await db.JobRun.claim('refresh_stats', bucket.isoformat()):
+        bot_logger.debug('Статистика за интервал с %s уже пересчитана.', bucket)
+        return
+    # Ключи - ISO-время в UTC, строковый порядок совпадает с хронологическим.
+    await db.JobRun.prune('refresh_stats', bucket.isoformat())
+    await db.Stats.refresh()
+    bot_logger.debug('Статистика пересчитана.')
+
+async def shutdown(application):
+    """Закрытие соединений с внешними сервисами при остановке бота."""
+    await prefetcher.close()
+    await apod_client.close()
+    if media_store is not None:
+        await media_store.close()
+    await db.write_behind.close()
+    await db.dispose()
+
+async def startup(application):
+    """Проверка внешних зависимостей перед приёмом апдейтов."""
+    await db.wait_for_db()
+
+def singleton_job(callback):
+    """Задача по расписанию выполняется одной репликой, остальные пропускают запуск."""
+    @wraps(callback)
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE):
+        async with db.advisory_lock(f'job:{callback.__name__}') as acquired:
+            if not acquired:
+                bot_logger.info('Задача %s выполняется другой репликой.', callback.__name__)
+                return
+            return await callback(context)
+    return wrapper
+
+def track_activity(callback):
+    """Отметка времени последней активности пользователя (отложенной записью)."""
+    @wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user is not None:
+            db.write_behind.touch(update.effective_user.id)
+        return await callback(update, context)
+    return wrapper
+
+def handler(callback):
+    """Апдейты одного пользователя - по порядку, с общим ограничением одновременности."""
+    return track_activity(user_locks.serialize(callback))
+
+def build_application(rate_limiter: bool = True):
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        # Одновременность ограничивает user_locks (после очереди пользователя);
+        # лимит PTB только отсекает неразумное число ждущих апдейтов.
+        .concurrent_updates(MAX_PENDING_UPDATES)
+        .post_init(startup)
+        .post_shutdown(shutdown)
+    )
+    if rate_limiter:
+        builder = builder.rate_limiter(AIORateLimiter(max_retries=3))
+    application = builder.build()
+    application.add_handler(CommandHandler('start', handler(start)))
+    application.add_handler(CommandHandler('admin', handler(admin)))
+    application.add_handler(CommandHandler('subscribe', handler(subscribe)))
+    application.add_handler(CommandHandler('unsubscribe', handler(unsubscribe)))
+    application.add_handler(CommandHandler('search', handler(search)))
+    application.add_handler(CommandHandler('random', handler(random_apod)))
+    application.add_handler(CommandHandler('date', handler(date_apod)))
+    application.add_handler(
+        ChatMemberHandler(handler(chat_member), ChatMemberHandler.MY_CHAT_MEMBER)
+    )
+    application.add_handler(CallbackQueryHandler(handler(button_dispatcher)))
+    application.add_handler(MessageHandler(filters=filters.TEXT, callback=user_messages))
+    application.job_queue.run_once(singleton_job(daily_apod), when=0)
+    application.job_queue.run_daily(
+        singleton_job(daily_apod), time=APOD_DAILY_JOB_TIME
+    )
+    application.job_queue.run_daily(singleton_job(daily_broadcast), time=BROADCAST_TIME)
+    application.job_queue.run_repeating(
+        singleton_job(refresh_stats),
+        interval=STATS_REFRESH_INTERVAL, first=STATS_REFRESH_INTERVAL
+    )
+    return application
+
 if __name__ == '__main__':
-    logger_config(bot_logger)
+    logger_config()
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        # Без url Telegram некуда слать апдейты: бот молча ничего не получал бы.
+        bot_logger.critical('BOT_MODE=webhook, но WEBHOOK_URL не задан.')
+        sys.exit(1)
     bot_logger.debug('Preparing bot...')
+    if METRICS_PORT:
+        metrics.start_metrics_server(int(METRICS_PORT), METRICS_ADDR)
+    application = build_application()
     bot_logger.debug('... DONE!')
-    DB_CONNECT_TRIES = 10
-    for _ in range(DB_CONNECT_TRIES):
-        try:
-            conn = psycopg2.connect(
-                dbname=DB_DATABASE, 
-                user=DB_USERNAME, 
-                password=DB_PASSWORD, 
-                host=DB_HOSTNAME,
-                port=DB_PORT
-            )
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            cursor = conn.cursor()
-            bot_logger.info('Succees connect to DB!')
-            break
-        except OperationalError as err:
-            bot_logger.error(f'Connect to DB error! {err}')
-
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-    application.add_handler(CommandHandler('start', start))
-    application.add_handler(CommandHandler('admin', admin))
-    application.add_handler(CallbackQueryHandler(button_dispatcher))
-    application.add_handler(MessageHandler(filters=filters.TEXT, callback=user_messages))
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        application.run_polling()
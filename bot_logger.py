@@ -1,11 +1,74 @@
+"""Настройка логгирования.
+
+Хендлеры только кладут записи в очередь (QueueHandler); в stdout и файл их
+пишет отдельный поток (QueueListener), так что ввод-вывод логов не
+блокирует event loop. В файл (с ротацией) пишется JSON - по объекту на строку.
+"""
+import atexit
+import json
 import logging
+import queue
 import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from settings import (LOG_BACKUP_COUNT, LOG_FILE, LOG_FORMAT, LOG_LEVEL,
+                      LOG_MAX_BYTES)
+
+TEXT_FORMAT = "%(asctime)s - [%(levelname)s] %(message)s"
+# Атрибуты LogRecord; остальное пришло через extra= и попадает в JSON как есть.
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        data.update(
+            (key, value) for key, value in vars(record).items() if key not in RECORD_ATTRS
+        )
+        return json.dumps(data, ensure_ascii=False, default=str)
 
 
-def logger_config(logger):
-    logger.setLevel(logging.DEBUG)
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() форматирует запись целиком; здесь только
+    подставляются аргументы (объекты могут измениться, пока запись в очереди).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def logger_config(level: str = LOG_LEVEL, log_file: Optional[str] = LOG_FILE):
+    """Логгирование всех модулей через очередь; слушатель останавливается при выходе."""
     stream_handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter("%(asctime)s - [%(levelname)s] %(message)s")
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
-    logger.debug('Logger enabled...')
\ No newline at end of file
+    stream_handler.setFormatter(
+        JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    )
+    handlers = [stream_handler]
+    if log_file:
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers = [LazyQueueHandler(log_queue)]
+    root.setLevel(level.upper())
+    listener.start()
+    atexit.register(listener.stop)
+    root.debug('Logger enabled...')
@@ -0,0 +1,74 @@
+"""Ежедневная рассылка картинки дня подписчикам."""
+import asyncio
+import logging
+from typing import List, Optional, Union
+
+from telegram.error import Forbidden, TelegramError
+
+import database as db
+from concurrency import TokenBucket
+
+broadcast_logger = logging.getLogger(__name__)
+
+SENT, LEFT, FAILED = 'sent', 'left', 'failed'
+
+
+class Broadcaster:
+    """Рассылка одного сообщения всем подписчикам.
+
+    Подписчики читаются из БД пачками (keyset), отправка идёт параллельно,
+    но не чаще rate сообщений в секунду, чтобы оставить запас глобального
+    лимита Telegram интерактивным ответам. Картинка загружается в Telegram
+    один раз: пока file_id неизвестен, отправка идёт по одной (первые
+    подписчики могли заблокировать бота), потом - параллельно по file_id.
+    """
+
+    def __init__(self, bot, photo: Optional[Union[str, bytes]], text: str, reply_markup=None,
+                 rate: float = 20.0, batch_size: int = 500, file_id: Optional[str] = None):
+        self.bot = bot
+        self.photo = photo
+        self.text = text
+        self.reply_markup = reply_markup
+        self.batch_size = batch_size
+        self.file_id = file_id
+        self.bucket = TokenBucket(rate, burst=rate)
+        self.stats = {SENT: 0, LEFT: 0, FAILED: 0}
+
+    async def run(self) -> dict:
+        async for chat_ids in db.User.iter_subscribers(self.batch_size):
+            results = []
+            # По URL (или байтами) - по одной, пока какая-то не вернёт file_id.
+            while self.photo and self.file_id is None and len(results) < len(chat_ids):
+                results.append(await self.send(chat_ids[len(results)]))
+            results += await asyncio.gather(
+                *(self.send(chat_id) for chat_id in chat_ids[len(results):])
+            )
+            await self.mark_left([
+                chat_id for chat_id, result in zip(chat_ids, results) if result == LEFT
+            ])
+            for result in results:
+                self.stats[result] += 1
+        broadcast_logger.info('Рассылка завершена: %s.', self.stats)
+        return self.stats
+
+    async def send(self, chat_id: int) -> str:
+        await self.bucket.acquire()
+        try:
+            if self.photo:
+                message = await self.bot.send_photo(
+                    chat_id, self.file_id or self.photo, self.text, reply_markup=self.reply_markup
+                )
+                if self.file_id is None and message.photo:
+                    self.file_id = message.photo[-1].file_id
+            else:
+                await self.bot.send_message(chat_id, self.text, reply_markup=self.reply_markup)
+        except Forbidden:
+            return LEFT
+        except TelegramError as err:
+            broadcast_logger.warning('Не удалось отправить рассылку (%s): %r', chat_id, err)
+            return FAILED
+        return SENT
+
+    async def mark_left(self, chat_ids: List[int]):
+        if chat_ids:
+            await db.User.set_leave(chat_ids)
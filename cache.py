@@ -0,0 +1,295 @@
+import logging
+import re
+import time
+from array import array
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+import callbacks as cb
+import database as db
+import metrics
+
+cache_logger = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r'(?<=[.!?])(\s+)')
+
+
+def split_text(text: str, first_size: int, size: int) -> List[str]:
+    """Разбиение текста на части по границам предложений.
+
+    Первая часть не длиннее first_size (подпись к фото), остальные - size.
+    Предложения длиннее лимита режутся по символам.
+    """
+    parts = SENTENCE_END.split(text)
+    sentences = [''.join(parts[i:i+2]) for i in range(0, len(parts), 2)]
+    chunks, current, limit = [], '', first_size
+    for sentence in sentences:
+        if len(current) + len(sentence.rstrip()) <= limit:
+            current += sentence
+            continue
+        if current.strip():
+            chunks.append(current.strip())
+            current, limit = '', size
+        while len(sentence.rstrip()) > limit:
+            chunks.append(sentence[:limit])
+            sentence, limit = sentence[limit:], size
+        current = sentence
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+
+class ApodEntry(NamedTuple):
+    """Готовый к отправке ответ APOD API за одну дату.
+
+    image_url - картинка или ссылка на видео (media_type == 'video');
+    None у прочих типов, для которых API не отдаёт url.
+    """
+    date: str
+    image_url: Optional[str]
+    captions: List[str]
+    fetched_at: datetime
+    media_type: str = 'image'
+    hdurl: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    title: Optional[str] = None
+
+
+class LRUCache:
+    """Простой LRU-кэш в памяти процесса."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        return self._data.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ApodCache:
+    """Кэш ответов APOD API: LRU в памяти + таблица apod в БД.
+
+    Прошедшие даты не меняются и хранятся бессрочно,
+    запись за текущую дату (по NASA_API_TZ) обновляется раз в today_ttl.
+    """
+
+    def __init__(self, tz, today_ttl: timedelta, maxsize: int = 1024,
+                 caption_size: int = 1024, message_size: int = 4096):
+        self.tz = tz
+        self.today_ttl = today_ttl
+        self.caption_size = caption_size
+        self.message_size = message_size
+        self.lru = LRUCache(maxsize)
+
+    def today(self) -> str:
+        return datetime.now(tz=self.tz).strftime('%Y-%m-%d')
+
+    def is_fresh(self, entry: ApodEntry) -> bool:
+        if entry.date != self.today():
+            return True
+        return datetime.now(tz=self.tz) - entry.fetched_at < self.today_ttl
+
+    async def get(self, date: str, allow_stale: bool = False) -> Optional[ApodEntry]:
+        """Запись за дату; устаревшая запись за сегодня - только с allow_stale."""
+        entry, source = self.lru.get(date), 'lru'
+        if entry is None:
+            row = await db.Apod.get(datetime.strptime(date, '%Y-%m-%d').date())
+            if row is None:
+                metrics.cache_lookup('apod', 'miss')
+                return None
+            entry, source = self.from_row(row), 'db'
+            self.lru.put(date, entry)
+            cache_logger.debug('APOD от %s загружен из БД.', date)
+        if not self.is_fresh(entry):
+            if not allow_stale:
+                metrics.cache_lookup('apod', 'miss')
+                return None
+            source = 'stale'
+        metrics.cache_lookup('apod', source)
+        return entry
+
+    async def reload(self, date: str) -> Optional[ApodEntry]:
+        """Свежая запись из БД в обход LRU (её могла обновить другая реплика)."""
+        row = await db.Apod.get(datetime.strptime(date, '%Y-%m-%d').date())
+        if row is None:
+            return None
+        entry = self.from_row(row)
+        if not self.is_fresh(entry):
+            return None
+        self.lru.put(date, entry)
+        metrics.cache_lookup('apod', 'db')
+        return entry
+
+    def build_captions(self, date: str, explanation: str) -> List[str]:
+        """Подпись к фото и продолжение описания отдельными сообщениями."""
+        caption = f'Картинка от {date[-2:]}.{date[-5:-3]}\n' + explanation
+        return split_text(caption, self.caption_size, self.message_size)
+
+    def make_entry(self, response: dict) -> ApodEntry:
+        date = response['date']
+        return ApodEntry(
+            date,
+            response.get('url'),
+            self.build_captions(date, response.get('explanation', '')),
+            datetime.now(tz=self.tz),
+            response.get('media_type', 'image'),
+            response.get('hdurl'),
+            response.get('thumbnail_url'),
+            response.get('title')
+        )
+
+    async def put(self, response: dict) -> ApodEntry:
+        """Сохранение ответа APOD API за одну дату."""
+        entry = self.make_entry(response)
+        self.lru.put(entry.date, entry)
+        await db.Apod.save([self.to_row(entry, response.get('explanation'))])
+        return entry
+
+    async def put_many(self, responses: List[dict]) -> int:
+        """Пакетное сохранение ответов APOD API (в LRU не попадают)."""
+        rows = [
+            self.to_row(self.make_entry(response), response.get('explanation'))
+            for response in responses
+        ]
+        await db.Apod.save(rows)
+        return len(rows)
+
+    def to_row(self, entry: ApodEntry, explanation: Optional[str] = None):
+        return db.Apod(
+            datetime.strptime(entry.date, '%Y-%m-%d').date(),
+            entry.image_url,
+            entry.captions,
+            entry.fetched_at,
+            entry.media_type,
+            entry.hdurl,
+            entry.thumbnail_url,
+            entry.title,
+            explanation
+        )
+
+    def from_row(self, row) -> ApodEntry:
+        return ApodEntry(
+            row.date.strftime('%Y-%m-%d'),
+            row.image_url,
+            row.captions,
+            row.fetched_at,
+            row.media_type,
+            row.hdurl,
+            row.thumbnail_url,
+            row.title
+        )
+
+
+class MediaCache:
+    """Кэш file_id картинок APOD, уже загруженных в Telegram.
+
+    file_id привязан к url: если NASA заменит картинку дня, он не используется.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.lru = LRUCache(maxsize)
+
+    async def get(self, date: str, url: str) -> Optional[str]:
+        cached, source = self.lru.get(date), 'lru'
+        if cached is None:
+            row = await db.TelegramFile.get(datetime.strptime(date, '%Y-%m-%d').date())
+            if row is None:
+                metrics.cache_lookup('file_id', 'miss')
+                return None
+            cached, source = (row.url, row.file_id), 'db'
+            self.lru.put(date, cached)
+        cached_url, file_id = cached
+        metrics.cache_lookup('file_id', source if cached_url == url else 'miss')
+        return file_id if cached_url == url else None
+
+    async def put(self, date: str, url: str, file_id: str):
+        self.lru.put(date, (url, file_id))
+        await db.TelegramFile(
+            datetime.strptime(date, '%Y-%m-%d').date(), url, file_id
+        ).save()
+
+
+class UserState:
+    """Состояние пользователя, нужное хендлерам.
+
+    favs - pic_date избранного в порядке добавления, как смещения в днях от
+    APOD_EPOCH (2 байта на запись); None - ещё не загружено из БД.
+    """
+    __slots__ = ('registered', 'favs', 'created_at')
+
+    def __init__(self):
+        self.registered = False
+        self.favs: Optional[array] = None
+        self.created_at = time.monotonic()
+
+    def set_favs(self, days: List[date]):
+        self.favs = array('H', ((day - cb.APOD_EPOCH).days for day in days))
+
+    def add_fav(self, day: date):
+        offset = (day - cb.APOD_EPOCH).days
+        if self.favs is not None and offset not in self.favs:
+            self.favs.append(offset)
+
+    def last_fav(self) -> Optional[date]:
+        if not self.favs:
+            return None
+        return cb.APOD_EPOCH + timedelta(days=self.favs[-1])
+
+    def fav_neighbours(self, day: date) -> Optional[Tuple[Optional[date], Optional[date], int]]:
+        """(prev, next, total) как у User.get_fav_neighbours; None - нет данных."""
+        if self.favs is None:
+            return None
+        try:
+            index = self.favs.index((day - cb.APOD_EPOCH).days)
+        except ValueError:
+            return None
+        prev = self.favs[index - 1] if index > 0 else None
+        next = self.favs[index + 1] if index + 1 < len(self.favs) else None
+        return (
+            cb.APOD_EPOCH + timedelta(days=prev) if prev is not None else None,
+            cb.APOD_EPOCH + timedelta(days=next) if next is not None else None,
+            len(self.favs)
+        )
+
+
+class UserStateCache:
+    """LRU состояний пользователей; запись живёт не дольше ttl секунд."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0):
+        self.ttl = ttl
+        self.lru = LRUCache(maxsize)
+
+    def get(self, user_id: int) -> UserState:
+        state = self.lru.get(user_id)
+        if state is None or time.monotonic() - state.created_at > self.ttl:
+            metrics.cache_lookup('user_state', 'miss')
+            state = UserState()
+            self.lru.put(user_id, state)
+        else:
+            metrics.cache_lookup('user_state', 'lru')
+        return state
+
+    async def load_favs(self, user_id: int) -> UserState:
+        state = self.get(user_id)
+        if state.favs is None:
+            state.set_favs(await db.User.get_fav_dates(user_id))
+        return state
@@ -0,0 +1,59 @@
+"""Компактный формат callback_data: '<тип>:<день>'.
+
+День кодируется числом дней от первой записи APOD (APOD_FIRST_DATE),
+так что данные кнопки укладываются в несколько байт из 64 допустимых.
+"""
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+from settings import APOD_FIRST_DATE, NASA_API_TZ
+
+APOD_EPOCH = datetime.strptime(APOD_FIRST_DATE, '%Y-%m-%d').date()
+
+DAY = 'd'
+FAV = 'f'
+FAV_ADD = 'a'
+HD = 'h'
+MENU = 'm'
+TOP = 't'
+DATED = {DAY, FAV, FAV_ADD, HD}
+
+# Данные кнопки присылает клиент, поэтому только ASCII-цифры (str.isdigit и
+# \d без re.ASCII пропускают '²' и цифры других алфавитов).
+COMPACT_PATTERN = re.compile(r'([a-z])(?::(\d{1,6}))?', re.ASCII)
+# Кнопки, отправленные до перехода на компактный формат.
+LEGACY_PATTERN = re.compile(r'(?:(fav: |favs_add: )?(\d{4})-(\d\d)-(\d\d)|(menu))', re.ASCII)
+LEGACY_KINDS = {None: DAY, 'fav: ': FAV, 'favs_add: ': FAV_ADD}
+
+
+def encode(kind: str, day: Optional[date] = None) -> str:
+    if day is None:
+        return kind
+    return f'{kind}:{(day - APOD_EPOCH).days}'
+
+
+def decode(data: str) -> Tuple[Optional[str], Optional[date]]:
+    """Тип кнопки и день; (None, None) для нераспознанных данных и дней вне архива."""
+    compact = COMPACT_PATTERN.fullmatch(data)
+    if compact is not None:
+        kind, offset = compact.groups()
+        if offset is None:
+            return (None, None) if kind in DATED else (kind, None)
+        return _dated(kind, APOD_EPOCH + timedelta(days=int(offset)))
+    legacy = LEGACY_PATTERN.fullmatch(data)
+    if legacy is None:
+        return None, None
+    prefix, year, month, day, menu = legacy.groups()
+    if menu:
+        return MENU, None
+    try:
+        return _dated(LEGACY_KINDS[prefix], date(int(year), int(month), int(day)))
+    except ValueError:
+        return None, None
+
+
+def _dated(kind: str, day: date) -> Tuple[Optional[str], Optional[date]]:
+    if not APOD_EPOCH <= day <= datetime.now(tz=NASA_API_TZ).date():
+        return None, None
+    return kind, day
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Dict
+
+
+class UserLocks:
+    """Очередь апдейтов по пользователям при параллельной обработке.
+
+    Апдейты разных пользователей обрабатываются одновременно (не больше
+    limit), апдейты одного пользователя - строго по порядку поступления
+    (asyncio.Lock отдаёт блокировку ожидающим в порядке FIFO). Слот из limit
+    берётся уже после блокировки пользователя: очередь одного пользователя
+    не занимает слоты, нужные остальным.
+    """
+
+    def __init__(self, limit: int):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+        self._slots = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def hold(self, user_id: int):
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._waiters[user_id] = self._waiters.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[user_id] -= 1
+            if not self._waiters[user_id]:
+                del self._waiters[user_id]
+                del self._locks[user_id]
+
+    def serialize(self, handler):
+        """Обёртка хендлера: один апдейт пользователя за раз."""
+        @wraps(handler)
+        async def wrapper(update, context):
+            user = update.effective_user
+            if user is None:
+                async with self._slots:
+                    return await handler(update, context)
+            async with self.hold(user.id), self._slots:
+                return await handler(update, context)
+        return wrapper
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate операций в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -1,25 +1,124 @@
-from datetime import datetime
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Integer,
-                        String, and_, create_engine, exists, select)
+from sqlalchemy import (JSON, Boolean, Column, Computed, Date, DateTime,
+                        ForeignKey, Index, Integer, String, Text, and_,
+                        bindparam, delete, false, select, text, true, tuple_,
+                        update)
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import func, select
+from sqlalchemy.orm import aliased, deferred
+from sqlalchemy.sql import column, func, select, table
 
-from bot import DB_URL
+import metrics
+from settings import (DB_ASYNC_URL, DB_CONNECT_BACKOFF, DB_CONNECT_RETRIES,
+                      DB_MAX_OVERFLOW, DB_POOL_SIZE, WRITE_BEHIND_BATCH_SIZE,
+                      WRITE_BEHIND_INTERVAL)
+
+db_logger = logging.getLogger(__name__)
 
-Session = sessionmaker()
-engine = create_engine(DB_URL)
-Session.configure(bind=engine)
-session = Session()
 Base = declarative_base()
 
 metadata = Base.metadata
 
+# Движок создаётся при первом обращении: импорт модуля не открывает соединений.
+_engine = None
+_sessionmaker = None
+
+
+def get_engine():
+    global _engine, _sessionmaker
+    if _engine is None:
+        _engine = create_async_engine(
+            DB_ASYNC_URL,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+        )
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    return _engine
+
+
+def new_session():
+    get_engine()
+    return _sessionmaker()
+
+
+async def dispose():
+    """Закрытие пула соединений (если он был создан)."""
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _sessionmaker = None
+
+
+@asynccontextmanager
+async def advisory_lock(name: str):
+    """Сессионная advisory-блокировка Postgres без ожидания.
+
+    Отдаёт True, если блокировка взята этим процессом, False - если её держит
+    другой. Держится на отдельном соединении до выхода из блока; если процесс
+    упадёт, Postgres снимет её вместе с соединением.
+    """
+    key = func.hashtext(name)
+    async with get_engine().connect() as conn:
+        acquired = await conn.scalar(select(func.pg_try_advisory_lock(key)))
+        await conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await conn.execute(select(func.pg_advisory_unlock(key)))
+                await conn.commit()
+
+
+async def wait_for_db(retries: int = DB_CONNECT_RETRIES, backoff: float = DB_CONNECT_BACKOFF):
+    """Проверка доступности БД при старте.
+
+    Делает до retries + 1 попыток с экспоненциальной задержкой; если БД так и
+    не ответила, пробрасывает последнюю ошибку.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with get_engine().connect() as conn:
+                await conn.execute(select(1))
+            return
+        except (OSError, SQLAlchemyError) as err:
+            if attempt == retries:
+                db_logger.error('БД недоступна после %s попыток: %r', retries + 1, err)
+                raise
+            delay = backoff * 2 ** attempt
+            db_logger.warning('БД недоступна (%r), повтор через %.1f с...', err, delay)
+            await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def session_scope():
+    """Короткая сессия на один запрос к БД.
+
+    Соединение возвращается в пул сразу после запроса, а не держится
+    (idle in transaction) всё время обработки апдейта, пока идут запросы
+    к Telegram и APOD API.
+    """
+    async with new_session() as session:
+        yield session
+
 
 class User(Base):
     __tablename__ = "users"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index(
+            'ix_users_subscribers', 'id',
+            postgresql_where=text('is_subscribed AND NOT is_leave')
+        ),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False, unique=True)
@@ -29,6 +128,8 @@ class User(Base):
     is_bot = Column(Boolean)
     is_admin = Column(Boolean, nullable=False, default=False)
     is_leave = Column(Boolean, nullable=False, default=False)
+    is_subscribed = Column(Boolean, nullable=False, default=False, server_default=false())
+    last_seen_at = Column(DateTime(timezone=True))
 
     def __init__(self, user, is_admin=False):
         self.user_id = user.id
@@ -38,35 +139,111 @@ class User(Base):
         self.is_admin = is_admin
         self.is_leave = False
 
-    def exists(self):
-        return session.query(exists().where(
-            User.user_id == self.user_id)).scalar()
-
     @classmethod
-    def get_all(cls, limit: int):
-        query = select(cls).limit(limit)
-        return session.execute(query).fetchall()
+    @metrics.track_query
+    async def get_fav_dates(cls, user_id: int):
+        """pic_date всего избранного пользователя в порядке добавления.
+
+        Включает ещё не записанное в БД избранное из очереди write_behind.
+        """
+        query = select(Favorite.pic_date).where(
+            Favorite.user_id == user_id
+        ).order_by(Favorite.added_date, Favorite.id)
+        async with session_scope() as session:
+            dates = (await session.execute(query)).scalars().all()
+        saved = set(dates)
+        return dates + [date for date in write_behind.pending_favs(user_id) if date not in saved]
 
-    def get_last_fav(self):
-        query = select(Favorite).where(Favorite.user_id==self.user_id).order_by(Favorite.added_date.desc())
-        return session.execute(query).fetchone()
-    
-    def get_all_favs(self):
-        query = select(Favorite).where(Favorite.user_id==self.user_id).order_by(Favorite.added_date.desc())
-        return session.execute(query).fetchall()
+    @metrics.track_query
+    async def get_fav_neighbours(self, date: datetime.date):
+        """Соседи избранного от date и число избранных у пользователя.
 
-    def get_fav_by_pic_date(self, date: datetime.date):
-        query = select(Favorite).where(
+        prev - следующее по давности добавления, next - более новое.
+        Один запрос по индексу (user_id, added_date, id), без загрузки всего списка.
+        """
+        fav = aliased(Favorite)
+        current = select(Favorite.added_date, Favorite.id).where(
             and_(
                 Favorite.user_id == self.user_id,
                 Favorite.pic_date == date
             )
+        ).subquery()
+        key = tuple_(fav.added_date, fav.id)
+        current_key = tuple_(current.c.added_date, current.c.id)
+
+        def neighbour(newer: bool):
+            if newer:
+                condition, order = key > current_key, (fav.added_date, fav.id)
+            else:
+                condition, order = key < current_key, (fav.added_date.desc(), fav.id.desc())
+            return select(fav.pic_date).select_from(fav).join(current, true()).where(
+                and_(fav.user_id == self.user_id, condition)
+            ).order_by(*order).limit(1).scalar_subquery()
+
+        total = select(func.count()).select_from(fav).where(
+            fav.user_id == self.user_id
+        ).scalar_subquery()
+        query = select(
+            neighbour(newer=False).label('prev'),
+            neighbour(newer=True).label('next'),
+            total.label('total')
         )
-        return session.execute(query).fetchone()
+        async with session_scope() as session:
+            return (await session.execute(query)).one()
+
+    @metrics.track_query
+    async def upsert(self) -> bool:
+        """Регистрация одним запросом; True, если пользователь новый."""
+        query = insert(User).values(
+            user_id=self.user_id,
+            first_name=self.first_name,
+            last_name=self.last_name,
+            username=self.username,
+            is_admin=self.is_admin,
+            is_leave=self.is_leave
+        ).on_conflict_do_nothing(index_elements=[User.user_id]).returning(User.id)
+        async with session_scope() as session:
+            created = (await session.execute(query)).scalar() is not None
+            await session.commit()
+        return created
+
+    @classmethod
+    @metrics.track_query
+    async def set_subscribed(cls, user_id: int, is_subscribed: bool):
+        query = update(cls).where(cls.user_id == user_id).values(is_subscribed=is_subscribed)
+        async with session_scope() as session:
+            await session.execute(query)
+            await session.commit()
+
+    @classmethod
+    @metrics.track_query
+    async def set_leave(cls, user_ids: list, is_leave: bool = True):
+        """Отметка пользователей, заблокировавших (или разблокировавших) бота."""
+        query = update(cls).where(cls.user_id.in_(user_ids)).values(is_leave=is_leave)
+        async with session_scope() as session:
+            await session.execute(query)
+            await session.commit()
+
+    @classmethod
+    @metrics.track_query
+    async def get_subscribers(cls, after_id: int, limit: int):
+        """Пачка (id, user_id) подписчиков с id > after_id (keyset-пагинация)."""
+        query = select(cls.id, cls.user_id).where(
+            and_(cls.is_subscribed, ~cls.is_leave, cls.id > after_id)
+        ).order_by(cls.id).limit(limit)
+        async with session_scope() as session:
+            return (await session.execute(query)).fetchall()
 
-    def commit(self):
-        session.add(self)
-        session.commit()
+    @classmethod
+    async def iter_subscribers(cls, batch_size: int = 500):
+        """Подписчики пачками, без загрузки всей таблицы."""
+        after_id = 0
+        while True:
+            batch = await cls.get_subscribers(after_id, batch_size)
+            if not batch:
+                return
+            yield [row.user_id for row in batch]
+            after_id = batch[-1].id
 
     def __repr__(self):
         return "<User (user_id=%i, first_name=%s, username=%s)>" % (
@@ -76,7 +253,13 @@ class User(Base):
 
 class Favorite(Base):
     __tablename__ = "favs"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Ключ листания избранного - (added_date, id): вся пачка отложенной
+        # записи получает одинаковый added_date.
+        Index('ix_favs_user_id_added_date_id', 'user_id', 'added_date', 'id'),
+        Index('ux_favs_user_id_pic_date', 'user_id', 'pic_date', unique=True),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
@@ -101,25 +284,359 @@ class Favorite(Base):
             )
         return self.pic_date < operand.pic_date
 
-    def exists(self):
-        return session.query(
-            exists().where(
-                and_(
-                    Favorite.user_id == self.user_id,
-                    Favorite.pic_date == self.pic_date
-                )
-            )).scalar()
-    
-    @classmethod
-    def get_all(cls, limit: int):
-        query = select(cls).limit(limit)
-        return session.execute(query).fetchall()
-               
-    def commit(self):
-        session.add(self)
-        session.commit()
-
     def __repr__(self):
         return "<Fav (user_id=%i, pic=%s, added=%s>" % (
             self.user_id, self.pic_date, self.added_date
         )
+
+
+class Apod(Base):
+    __tablename__ = "apod"
+    __table_args__ = (
+        Index('ix_apod_search', 'search', postgresql_using='gin'),
+        {'extend_existing': True},
+    )
+
+    date = Column(Date, primary_key=True)
+    # Пусто у записей без url (media_type не image/video).
+    image_url = Column(String)
+    captions = Column(JSON, nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    media_type = Column(String, nullable=False, server_default='image')
+    hdurl = Column(String)
+    thumbnail_url = Column(String)
+    title = Column(String)
+    # Нужны только поиску: при чтении записи не загружаются.
+    explanation = deferred(Column(Text))
+    # Атрибут не называется search: так называется метод поиска ниже.
+    search_vector = deferred(Column('search', TSVECTOR, Computed(
+        "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(explanation, ''))",
+        persisted=True
+    )))
+
+    def __init__(self, date: datetime.date, image_url: Optional[str], captions: list, fetched_at: datetime,
+                 media_type: str = 'image', hdurl: str = None, thumbnail_url: str = None,
+                 title: str = None, explanation: str = None):
+        self.date = date
+        self.image_url = image_url
+        self.captions = captions
+        self.fetched_at = fetched_at
+        self.media_type = media_type
+        self.hdurl = hdurl
+        self.thumbnail_url = thumbnail_url
+        self.title = title
+        self.explanation = explanation
+
+    @classmethod
+    @metrics.track_query
+    async def get(cls, date: datetime.date):
+        async with session_scope() as session:
+            return await session.get(cls, date)
+
+    @classmethod
+    @metrics.track_query
+    async def last_date(cls):
+        async with session_scope() as session:
+            return await session.scalar(select(func.max(cls.date)))
+
+    @classmethod
+    @metrics.track_query
+    async def save(cls, rows: list):
+        async with session_scope() as session:
+            for row in rows:
+                await session.merge(row)
+            await session.commit()
+
+    @classmethod
+    @metrics.track_query
+    async def search(cls, words: str, limit: int = 10):
+        """(date, title) записей, подходящих под words, по убыванию релевантности."""
+        terms = func.websearch_to_tsquery('english', words)
+        query = select(cls.date, cls.title).where(
+            cls.search_vector.op('@@')(terms)
+        ).order_by(func.ts_rank(cls.search_vector, terms).desc(), cls.date.desc()).limit(limit)
+        async with session_scope() as session:
+            return (await session.execute(query)).fetchall()
+
+    @classmethod
+    @metrics.track_query
+    async def random_date(cls, first: datetime.date, last: datetime.date):
+        """Случайная сохранённая дата: первая не раньше случайного дня из [first, last]."""
+        day = first + timedelta(days=random.randint(0, (last - first).days))
+        async with session_scope() as session:
+            found = await session.scalar(
+                select(cls.date).where(cls.date >= day).order_by(cls.date).limit(1)
+            )
+            if found is None:
+                found = await session.scalar(select(func.max(cls.date)))
+        return found
+
+    def __repr__(self):
+        return "<Apod (date=%s, url=%s)>" % (self.date, self.image_url)
+
+
+class TelegramFile(Base):
+    __tablename__ = "tg_files"
+    __table_args__ = {'extend_existing': True}
+
+    pic_date = Column(Date, primary_key=True)
+    url = Column(String, nullable=False)
+    file_id = Column(String, nullable=False)
+
+    def __init__(self, pic_date: datetime.date, url: str, file_id: str):
+        self.pic_date = pic_date
+        self.url = url
+        self.file_id = file_id
+
+    @classmethod
+    @metrics.track_query
+    async def get(cls, date: datetime.date):
+        async with session_scope() as session:
+            return await session.get(cls, date)
+
+    @metrics.track_query
+    async def save(self):
+        query = insert(TelegramFile).values(
+            pic_date=self.pic_date,
+            url=self.url,
+            file_id=self.file_id
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[TelegramFile.pic_date],
+            set_={'url': query.excluded.url, 'file_id': query.excluded.file_id}
+        )
+        async with session_scope() as session:
+            await session.execute(query)
+            await session.commit()
+
+    def __repr__(self):
+        return "<TelegramFile (pic_date=%s, file_id=%s)>" % (self.pic_date, self.file_id)
+
+
+class JobRun(Base):
+    """Запуски задач по расписанию: не больше одной строки на (задачу, ключ)."""
+    __tablename__ = "job_runs"
+    __table_args__ = {'extend_existing': True}
+
+    name = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    started_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    @classmethod
+    @metrics.track_query
+    async def claim(cls, name: str, key: str) -> bool:
+        """True только для первого процесса, запустившего задачу с этим ключом."""
+        query = insert(cls).values(name=name, key=key).on_conflict_do_nothing().returning(cls.name)
+        async with session_scope() as session:
+            claimed = (await session.execute(query)).scalar() is not None
+            await session.commit()
+        return claimed
+
+    @classmethod
+    @metrics.track_query
+    async def prune(cls, name: str, before_key: str):
+        """Удаление отметок задачи с ключами меньше before_key."""
+        query = delete(cls).where(and_(cls.name == name, cls.key < before_key))
+        async with session_scope() as session:
+            await session.execute(query)
+            await session.commit()
+
+
+class UserDay(Base):
+    """Дни, в которые пользователь был активен (пишет WriteBehind)."""
+    __tablename__ = "user_days"
+    __table_args__ = {'extend_existing': True}
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+
+
+# Материализованные представления (миграция stats_views), обновляются Stats.refresh().
+top_favs_view = table(
+    'mv_top_favs', column('pic_date'), column('title'), column('favs')
+)
+daily_active_view = table(
+    'mv_daily_active_users', column('day'), column('users')
+)
+user_favs_view = table(
+    'mv_user_favs', column('user_id'), column('favs')
+)
+summary_view = table(
+    'mv_usage_summary', column('users'), column('active_users'), column('subscribers'),
+    column('favs'), column('users_with_favs'), column('refreshed_at')
+)
+
+
+class Stats:
+    """Статистика использования из материализованных представлений.
+
+    Чтения идут по индексам представлений и не зависят от размера favs;
+    сами представления пересчитываются по расписанию (refresh).
+    """
+    VIEWS = ('mv_top_favs', 'mv_daily_active_users', 'mv_user_favs', 'mv_usage_summary')
+
+    @classmethod
+    @metrics.track_query
+    async def refresh(cls):
+        async with session_scope() as session:
+            for view in cls.VIEWS:
+                await session.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}'))
+            await session.commit()
+
+    @classmethod
+    @metrics.track_query
+    async def top_pictures(cls, limit: int = 10):
+        """(pic_date, title, favs) самых популярных в избранном картинок."""
+        view = top_favs_view.c
+        query = select(view.pic_date, view.title, view.favs).order_by(
+            view.favs.desc(), view.pic_date.desc()
+        ).limit(limit)
+        async with session_scope() as session:
+            return (await session.execute(query)).fetchall()
+
+    @classmethod
+    @metrics.track_query
+    async def daily_active_users(cls, days: int = 7):
+        """(day, users) за последние days дней с активностью."""
+        view = daily_active_view.c
+        query = select(view.day, view.users).order_by(view.day.desc()).limit(days)
+        async with session_scope() as session:
+            return (await session.execute(query)).fetchall()
+
+    @classmethod
+    @metrics.track_query
+    async def top_users(cls, limit: int = 10):
+        """(user_id, favs) пользователей с самым большим избранным."""
+        view = user_favs_view.c
+        query = select(view.user_id, view.favs).order_by(
+            view.favs.desc(), view.user_id
+        ).limit(limit)
+        async with session_scope() as session:
+            return (await session.execute(query)).fetchall()
+
+    @classmethod
+    @metrics.track_query
+    async def summary(cls):
+        async with session_scope() as session:
+            return (await session.execute(select(summary_view))).first()
+
+
+class WriteBehind:
+    """Отложенная пачечная запись избранного и времени последней активности.
+
+    Хендлеры только ставят записи в очередь и сразу отвечают пользователю;
+    очередь сбрасывается в БД раз в interval секунд или по набору batch_size
+    записей: избранное - одним многострочным INSERT, активность - одним
+    executemany. Повторы схлопываются до сброса. close() дописывает остаток.
+    """
+
+    def __init__(self, interval: float = 1.0, batch_size: int = 500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._favs: Dict[Tuple[int, datetime.date], None] = {}
+        self._seen: Dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def add_favorite(self, user_id: int, date: datetime.date):
+        self._favs[(user_id, date)] = None
+        self._enqueued()
+
+    def touch(self, user_id: int):
+        self._seen[user_id] = datetime.now(timezone.utc)
+        self._enqueued()
+
+    def pending_favs(self, user_id: int) -> List[datetime.date]:
+        return [date for fav_user_id, date in self._favs if fav_user_id == user_id]
+
+    def _enqueued(self):
+        if self._task is None and not self._closing:
+            self._task = asyncio.create_task(self._run())
+        if len(self._favs) + len(self._seen) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Задача живёт до close(): без неё очередь больше не сбросится.
+                db_logger.exception('Ошибка сброса отложенной записи')
+
+    async def flush(self):
+        async with self._lock:
+            favs, self._favs = self._favs, {}
+            seen, self._seen = self._seen, {}
+            if favs:
+                await self._write(self._save_favs, favs, self._favs)
+            if seen:
+                await self._write(self._save_seen, seen, self._seen)
+
+    async def _write(self, save, batch: dict, queue: dict):
+        try:
+            await save(batch)
+        except BaseException as err:
+            # Вернуть в очередь до следующего сброса, не затирая новые записи:
+            # пачка не теряется и при отмене задачи посреди записи.
+            for key, value in batch.items():
+                queue.setdefault(key, value)
+            if not isinstance(err, (OSError, SQLAlchemyError)):
+                raise
+            db_logger.error('Ошибка отложенной записи (%s шт.): %r', len(batch), err)
+
+    @metrics.track_query
+    async def _save_favs(self, favs: dict):
+        # added_date у всей пачки одинаковый (now() транзакции), порядок
+        # добавления сохраняют id: строки вставляются в порядке очереди.
+        rows = [{'user_id': user_id, 'pic_date': date} for user_id, date in favs]
+        query = insert(Favorite).on_conflict_do_nothing(
+            index_elements=[Favorite.user_id, Favorite.pic_date]
+        )
+        async with session_scope() as session:
+            try:
+                await session.execute(query.values(rows))
+                await session.commit()
+                return
+            except IntegrityError:
+                await session.rollback()
+            # В пачке есть строка без пользователя в users - пишем по одной.
+            for row in rows:
+                try:
+                    await session.execute(query.values(row))
+                    await session.commit()
+                except IntegrityError:
+                    await session.rollback()
+                    db_logger.warning('Избранное не сохранено: %s', row)
+
+    @metrics.track_query
+    async def _save_seen(self, seen: dict):
+        query = update(User.__table__).where(
+            User.__table__.c.user_id == bindparam('uid')
+        ).values(last_seen_at=bindparam('seen_at'))
+        async with session_scope() as session:
+            await session.execute(
+                query, [{'uid': user_id, 'seen_at': seen_at} for user_id, seen_at in seen.items()]
+            )
+            await session.execute(insert(UserDay).values([
+                {'day': seen_at.date(), 'user_id': user_id} for user_id, seen_at in seen.items()
+            ]).on_conflict_do_nothing())
+            await session.commit()
+
+    async def close(self):
+        """Дождаться текущего сброса и дописать остаток очереди."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+write_behind = WriteBehind(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_BATCH_SIZE)
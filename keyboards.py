@@ -1,43 +1,71 @@
+from datetime import date, timedelta
 from typing import Union
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from utils import ExtDate
+import callbacks as cb
 
 
-def get_start_keyboard(date: str, fav_date: Union[str, None] = None):
+def get_start_keyboard(today: date, fav_date: Union[date, None] = None):
     """Стартовое меню."""
-    keyboard = [[InlineKeyboardButton("🌌 Картинка дня", callback_data=date)],]
+    keyboard = [[InlineKeyboardButton("🌌 Картинка дня", callback_data=cb.encode(cb.DAY, today))],]
     if fav_date:
-        keyboard.append([InlineKeyboardButton("❤ Избранное", callback_data=fav_date)],)
+        keyboard.append([InlineKeyboardButton("❤ Избранное", callback_data=cb.encode(cb.FAV, fav_date))],)
+    keyboard.append([InlineKeyboardButton("🏆 Популярное", callback_data=cb.TOP)],)
     return InlineKeyboardMarkup(keyboard)
 
-def build_fav_keyboard(prev: Union[str, None] = None, next: Union[str, None] = None):
+def build_fav_keyboard(prev: Union[date, None] = None, next: Union[date, None] = None):
     """Создание клавиатуры-листалки для Избранного."""
-    keyboard = [[], [InlineKeyboardButton("return to menu", callback_data='menu'),],]
+    keyboard = [[], [InlineKeyboardButton("return to menu", callback_data=cb.MENU),],]
     if prev:
-        keyboard[0].append(InlineKeyboardButton("⬅️", callback_data=f'fav: {prev}'))
+        keyboard[0].append(InlineKeyboardButton("⬅️", callback_data=cb.encode(cb.FAV, prev)))
     if next:
-        keyboard[0].append(InlineKeyboardButton("➡️", callback_data=f'fav: {next}'))
+        keyboard[0].append(InlineKeyboardButton("➡️", callback_data=cb.encode(cb.FAV, next)))
     return InlineKeyboardMarkup(keyboard)
 
-def build_listing_keyboard(date: str, is_prev: bool = False, is_next: bool = False):
+def build_listing_keyboard(day: date, is_prev: bool = False, is_next: bool = False,
+                           is_hd: bool = False):
     """Создание клавиатуры-листалки фото."""
     keyboard = [
-        [InlineKeyboardButton("add to favorite", callback_data=f'favs_add: {date}'), ],
+        [InlineKeyboardButton("add to favorite", callback_data=cb.encode(cb.FAV_ADD, day)), ],
         [],
-        [InlineKeyboardButton("return to menu", callback_data='menu'), ],
+        [InlineKeyboardButton("return to menu", callback_data=cb.MENU), ],
     ]
+    if is_hd:
+        keyboard[0].append(InlineKeyboardButton("HD", callback_data=cb.encode(cb.HD, day)))
     if is_prev:
-        prev_date = ExtDate.strptime(date, '%Y-%m-%d').get_prev_day()
-        keyboard[1].append(InlineKeyboardButton("⬅️", callback_data=prev_date))
+        prev_date = day - timedelta(days=1)
+        keyboard[1].append(InlineKeyboardButton("⬅️", callback_data=cb.encode(cb.DAY, prev_date)))
     if is_next:
-        next_date = ExtDate.strptime(date, '%Y-%m-%d').get_next_day()
-        keyboard[1].append(InlineKeyboardButton("➡️", callback_data=next_date))
+        next_date = day + timedelta(days=1)
+        keyboard[1].append(InlineKeyboardButton("➡️", callback_data=cb.encode(cb.DAY, next_date)))
+    return InlineKeyboardMarkup(keyboard)
+
+def build_search_keyboard(results):
+    """Результаты поиска: кнопка на каждую найденную дату."""
+    keyboard = [
+        [InlineKeyboardButton(
+            f'{day:%d.%m.%Y} {title or ""}'.strip()[:64],
+            callback_data=cb.encode(cb.DAY, day)
+        )]
+        for day, title in results
+    ]
+    keyboard.append([InlineKeyboardButton("return to menu", callback_data=cb.MENU), ])
+    return InlineKeyboardMarkup(keyboard)
+
+def build_top_keyboard(top):
+    """Самые популярные в Избранном картинки."""
+    keyboard = [
+        [InlineKeyboardButton(
+            f'❤ {favs} · {day:%d.%m.%Y} {title or ""}'.strip()[:64],
+            callback_data=cb.encode(cb.DAY, day)
+        )]
+        for day, title, favs in top
+    ]
+    keyboard.append([InlineKeyboardButton("return to menu", callback_data=cb.MENU), ])
     return InlineKeyboardMarkup(keyboard)
 
 def build_return_to_menu_kb():
     """Клавиатура с кнопкой возврата в главное меню."""
-    keyboard = [[InlineKeyboardButton("return to menu", callback_data='menu'), ], ]
+    keyboard = [[InlineKeyboardButton("return to menu", callback_data=cb.MENU), ], ]
     return InlineKeyboardMarkup(keyboard)
-    
\ No newline at end of file
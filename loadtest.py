@@ -0,0 +1,387 @@
+"""Нагрузочный тест бота без выхода в сеть.
+
+Настоящий Application из bot.py обрабатывает синтетические апдейты тысяч
+пользователей; Telegram Bot API и APOD API подменяются локальными заглушками
+(отдельный процесс). БД - настоящая, из переменных окружения (DB_*), лучше
+отдельная: тестовые пользователи и избранное в ней остаются.
+
+Запуск:
+    python loadtest.py --users 2000 --actions 20 --concurrency 200 --create-schema
+
+Отчёт: p50/p95/p99 времени обработки апдейта по типам, апдейтов в секунду и
+число SQL-запросов на апдейт.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import socket
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from tornado.web import Application as WebApplication
+from tornado.web import RequestHandler
+
+loadtest_logger = logging.getLogger(__name__)
+
+LOADTEST_BOT_TOKEN = '123456:loadtest'
+LOADTEST_USER_ID_BASE = 1_000_000_000
+DEFAULT_MIX = 'start=1,page=6,fav_add=2,fav_browse=2'
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# Заглушки внешних API.
+
+def fake_apod(day: str) -> dict:
+    """Детерминированная запись APOD: каждая 7-я - видео, каждая 5-я - с длинным описанием."""
+    ordinal = datetime.strptime(day, '%Y-%m-%d').toordinal()
+    sentences = 40 if ordinal % 5 == 0 else 6
+    response = {
+        'date': day,
+        'title': f'Loadtest {day}',
+        'explanation': ' '.join(
+            f'Sentence {i} about the picture of {day}.' for i in range(sentences)
+        ),
+        'media_type': 'image',
+        'url': f'https://apod.invalid/image/{day}.jpg',
+        'hdurl': f'https://apod.invalid/image/{day}_hd.jpg',
+        'service_version': 'v1',
+    }
+    if ordinal % 7 == 0:
+        response.update(
+            media_type='video',
+            url=f'https://www.youtube.com/embed/{ordinal}',
+            thumbnail_url=f'https://img.youtube.invalid/{ordinal}.jpg',
+        )
+        del response['hdurl']
+    return response
+
+
+class FakeApodHandler(RequestHandler):
+    def initialize(self, latency: float):
+        self.latency = latency
+
+    async def get(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        day = self.get_query_argument('date', None)
+        if day is not None:
+            self.write(fake_apod(day))
+            return
+        start = datetime.strptime(self.get_query_argument('start_date'), '%Y-%m-%d').date()
+        end = datetime.strptime(self.get_query_argument('end_date'), '%Y-%m-%d').date()
+        responses = [
+            fake_apod((start + timedelta(days=i)).strftime('%Y-%m-%d'))
+            for i in range((end - start).days + 1)
+        ]
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(responses))
+
+
+class FakeBotApiHandler(RequestHandler):
+    """Ответы Bot API: методы send*/edit* возвращают сообщение, прочие - True."""
+
+    def initialize(self, latency: float):
+        self.latency = latency
+
+    def params(self) -> dict:
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(self.request.body or b'{}')
+        return {key: self.get_body_argument(key) for key in self.request.body_arguments}
+
+    async def post(self, token: str, method: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.write({'ok': True, 'result': self.result(method, self.params())})
+
+    def result(self, method: str, params: dict):
+        if method == 'getMe':
+            return {
+                'id': int(LOADTEST_BOT_TOKEN.split(':')[0]), 'is_bot': True,
+                'first_name': 'APOD', 'username': 'apod_loadtest_bot',
+            }
+        message = {
+            'message_id': int(params.get('message_id') or random.randint(1, 2 ** 31)),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+        }
+        if method in ('sendPhoto', 'editMessageMedia'):
+            photo = params.get('photo') or json.loads(params.get('media', '{}')).get('media', '')
+            file_id = f'photo-{abs(hash(photo))}'
+            message['photo'] = [
+                {'file_id': file_id, 'file_unique_id': file_id, 'width': 1024, 'height': 768}
+            ]
+            return message
+        if method == 'sendDocument':
+            message['document'] = {'file_id': 'document', 'file_unique_id': 'document'}
+            return message
+        if method in ('sendMessage', 'editMessageText'):
+            message['text'] = params.get('text', '')
+            return message
+        return True
+
+
+def serve_fakes(telegram_port: int, apod_port: int, latency: float):
+    async def serve():
+        WebApplication(
+            [(r'/bot([^/]+)/(\w+)', FakeBotApiHandler, {'latency': latency})]
+        ).listen(telegram_port, '127.0.0.1')
+        WebApplication(
+            [(r'/apod', FakeApodHandler, {'latency': latency})]
+        ).listen(apod_port, '127.0.0.1')
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+# Синтетические апдейты.
+
+class SimulatedUser:
+    """Пользователь, который листает картинки и Избранное.
+
+    Хранит сообщение бота, под которым нажимает кнопки: после /start - текст
+    с меню, после просмотра картинки - фото.
+    """
+
+    def __init__(self, user_id: int, today: date, rng: random.Random):
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.today = today
+        self.day = today - timedelta(days=rng.randint(0, 3650))
+        self.favs: List[date] = []
+        self.rng = rng
+        self.message = self._message(text='menu')
+
+    def _message(self, **content) -> dict:
+        return {
+            'message_id': self.rng.randint(1, 2 ** 31), 'date': int(time.time()),
+            'chat': self.chat, **content,
+        }
+
+    def _photo(self) -> dict:
+        return self._message(photo=[
+            {'file_id': 'photo', 'file_unique_id': 'photo', 'width': 1024, 'height': 768}
+        ])
+
+    def start(self) -> dict:
+        self.message = self._message(text='menu')
+        return {'message': self._message(
+            text='/start', **{'from': self.user},
+            entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        )}
+
+    def callback(self, data: str) -> dict:
+        return {'callback_query': {
+            'id': str(self.rng.getrandbits(63)), 'from': self.user,
+            'chat_instance': str(self.user['id']), 'message': self.message, 'data': data,
+        }}
+
+    def page(self, cb) -> dict:
+        step = self.rng.choice((-1, 1))
+        self.day = min(self.today, max(cb.APOD_EPOCH, self.day + timedelta(days=step)))
+        update = self.callback(cb.encode(cb.DAY, self.day))
+        self.message = self._photo()
+        return update
+
+    def fav_add(self, cb) -> dict:
+        if self.day not in self.favs:
+            self.favs.append(self.day)
+        return self.callback(cb.encode(cb.FAV_ADD, self.day))
+
+    def fav_browse(self, cb) -> dict:
+        if not self.favs:
+            return self.page(cb)
+        update = self.callback(cb.encode(cb.FAV, self.rng.choice(self.favs)))
+        self.message = self._photo()
+        return update
+
+
+class LoadTest:
+    def __init__(self, application, cb, mix: Dict[str, int], users: int, actions: int,
+                 concurrency: int, seed: int):
+        self.application = application
+        self.cb = cb
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.users = users
+        self.actions = actions
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rng = random.Random(seed)
+        self.update_id = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.queries: Dict[str, int] = defaultdict(int)
+        self._task_kinds: Dict[asyncio.Task, str] = {}
+
+    def count_query(self, *args):
+        """before_cursor_execute: запрос засчитывается апдейту, в задаче которого выполнен."""
+        self.queries[self._task_kinds.get(asyncio.current_task(), 'background')] += 1
+
+    async def on_error(self, update, context):
+        kind = self._task_kinds.get(asyncio.current_task(), 'background')
+        self.errors[kind] += 1
+        loadtest_logger.debug('Ошибка в %s: %r', kind, context.error)
+
+    async def process(self, kind: str, data: dict):
+        from telegram import Update
+
+        self.update_id += 1
+        update = Update.de_json({'update_id': self.update_id, **data}, self.application.bot)
+        task = asyncio.current_task()
+        self._task_kinds[task] = kind
+        started = time.perf_counter()
+        try:
+            await self.application.process_update(update)
+        finally:
+            self.latencies[kind].append(time.perf_counter() - started)
+            del self._task_kinds[task]
+
+    async def simulate(self, user: SimulatedUser):
+        async with self.semaphore:
+            await self.process('start', user.start())
+            for kind in self.rng.choices(self.kinds, self.weights, k=self.actions - 1):
+                data = user.start() if kind == 'start' else getattr(user, kind)(self.cb)
+                await self.process(kind, data)
+
+    async def run(self) -> float:
+        today = datetime.now().date()
+        users = [
+            SimulatedUser(LOADTEST_USER_ID_BASE + i, today, random.Random(self.rng.random()))
+            for i in range(self.users)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(self.simulate(user) for user in users))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> str:
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        lines = [
+            f'{"update":<12}{"count":>8}{"errors":>8}{"p50, ms":>10}{"p95, ms":>10}'
+            f'{"p99, ms":>10}{"queries":>10}'
+        ]
+        for kind in sorted(self.latencies):
+            latencies = self.latencies[kind]
+            lines.append(
+                f'{kind:<12}{len(latencies):>8}{self.errors[kind]:>8}'
+                f'{percentile(latencies, 50) * 1000:>10.1f}'
+                f'{percentile(latencies, 95) * 1000:>10.1f}'
+                f'{percentile(latencies, 99) * 1000:>10.1f}'
+                f'{self.queries[kind] / len(latencies):>10.2f}'
+            )
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        lines += [
+            '',
+            f'Апдейтов: {total} за {elapsed:.1f} с ({total / elapsed:.0f}/с), '
+            f'p50/p95/p99: {percentile(all_latencies, 50) * 1000:.1f}/'
+            f'{percentile(all_latencies, 95) * 1000:.1f}/'
+            f'{percentile(all_latencies, 99) * 1000:.1f} мс',
+            f'SQL-запросов на апдейт: {sum(self.queries.values()) / total:.2f} '
+            f'(из них фоновых: {self.queries["background"]})',
+        ]
+        return '\n'.join(lines)
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in ('start', 'page', 'fav_add', 'fav_browse'):
+            raise argparse.ArgumentTypeError(f'Неизвестный тип апдейта: {kind}')
+        weights[kind] = int(weight or 1)
+    return weights
+
+
+async def run(args) -> str:
+    import bot
+    import callbacks as cb
+    import database as db
+    from sqlalchemy import event
+
+    application = bot.build_application(rate_limiter=False)
+    await db.wait_for_db()
+    if args.create_schema:
+        async with db.get_engine().begin() as conn:
+            await conn.run_sync(db.metadata.create_all)
+    loadtest = LoadTest(
+        application, cb, args.mix, args.users, args.actions, args.concurrency, args.seed
+    )
+    application.add_error_handler(loadtest.on_error)
+    event.listen(db.get_engine().sync_engine, 'before_cursor_execute', loadtest.count_query)
+    await application.initialize()
+    try:
+        elapsed = await loadtest.run()
+    finally:
+        await application.shutdown()
+        await bot.shutdown(application)
+    return loadtest.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота на заглушках API.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--actions', type=int, default=20, help='апдейтов на пользователя')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='сколько пользователей активны одновременно')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'веса типов апдейтов (по умолчанию {DEFAULT_MIX})')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='задержка ответа заглушек API, с')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--create-schema', action='store_true',
+                        help='создать таблицы (для пустой БД без миграций)')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    telegram_port, apod_port = free_port(), free_port()
+    fakes = multiprocessing.Process(
+        target=serve_fakes, args=(telegram_port, apod_port, args.latency), daemon=True
+    )
+    fakes.start()
+    try:
+        wait_port(telegram_port)
+        wait_port(apod_port)
+        os.environ.update(
+            TELEGRAM_BOT_TOKEN_PROD=LOADTEST_BOT_TOKEN,
+            TELEGRAM_API_URL=f'http://127.0.0.1:{telegram_port}/bot',
+            TELEGRAM_FILE_URL=f'http://127.0.0.1:{telegram_port}/file/bot',
+            NASA_API_URL=f'http://127.0.0.1:{apod_port}/apod',
+            NASA_TOKEN='loadtest',
+        )
+        print(asyncio.run(run(args)))
+    finally:
+        fakes.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Локальная копия картинок APOD, подогнанная под ограничения Telegram.
+
+Оригинал скачивается один раз, уменьшается и хранится на диске под своим
+sha256 (content-addressed): objects/ab/abcdef....jpg. Индекс url -> sha256 -
+маленькие файлы в index/. Готовые картинки (до 10 МБ) читаются целиком в
+отдельном потоке и загружаются в Telegram байтами, без скачивания с
+apod.nasa.gov на стороне Telegram.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from typing import Dict, Optional
+
+import httpx
+
+media_logger = logging.getLogger(__name__)
+
+# Ограничения Telegram для фото: до 10 МБ, сумма сторон до 10000.
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+JPEG_QUALITIES = (87, 80, 70, 60)
+
+
+def resize_image(data: bytes, max_side: int, max_bytes: int) -> Optional[bytes]:
+    """JPEG не больше max_side по длинной стороне и max_bytes по размеру."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        for quality in JPEG_QUALITIES:
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+            if output.tell() <= max_bytes:
+                return output.getvalue()
+    return None
+
+
+class MediaStore:
+    """Дисковый кэш уменьшенных картинок.
+
+    Одновременные запросы одного url ждут одну загрузку. При любой ошибке
+    get() возвращает None, и картинка отправляется по url, как раньше.
+    """
+
+    def __init__(self, root: str, max_side: int = 2560,
+                 max_bytes: int = TELEGRAM_PHOTO_MAX_BYTES,
+                 download_limit: int = 50 * 1024 * 1024, timeout: float = 30.0):
+        self.root = root
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.download_limit = download_limit
+        self.timeout = httpx.Timeout(timeout, connect=5.0)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        os.makedirs(os.path.join(root, 'index'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True)
+        return self._client
+
+    def _index_path(self, url: str) -> str:
+        return os.path.join(self.root, 'index', hashlib.sha256(url.encode()).hexdigest())
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.jpg')
+
+    def _write(self, path: str, data: bytes):
+        """Атомарная запись: читатели не видят недописанный файл."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, url: str) -> Optional[bytes]:
+        # Битый или недоступный кэш - не ошибка: картинка скачается заново.
+        try:
+            with open(self._index_path(url)) as index:
+                digest = index.read().strip()
+            if not digest:
+                return None
+            with open(self._object_path(digest), 'rb') as file:
+                return file.read()
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url: str, data: bytes) -> Optional[bytes]:
+        resized = resize_image(data, self.max_side, self.max_bytes)
+        if resized is None:
+            return None
+        digest = hashlib.sha256(resized).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            self._write(path, resized)
+        self._write(self._index_path(url), digest.encode())
+        return resized
+
+    async def get(self, url: str) -> Optional[bytes]:
+        """Готовая к загрузке в Telegram картинка; None - отправлять по url."""
+        data = await asyncio.to_thread(self._read, url)
+        if data is not None:
+            return data
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str) -> Optional[bytes]:
+        async with self.client.stream('GET', url) as response:
+            if response.status_code != httpx.codes.OK:
+                media_logger.warning('Картинка %s не скачана: %s', url, response.status_code)
+                return None
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > self.download_limit:
+                    media_logger.warning('Картинка %s больше %s байт.', url, self.download_limit)
+                    return None
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    async def download(self, url: str) -> Optional[bytes]:
+        """Файл как есть, без обработки; None - ошибка или больше download_limit."""
+        try:
+            return await self._download(url)
+        except httpx.HTTPError as err:
+            media_logger.error('Ошибка скачивания %s: %r', url, err)
+            return None
+
+    async def _fetch(self, url: str) -> Optional[bytes]:
+        try:
+            data = await self._download(url)
+            if data is None:
+                return None
+            return await asyncio.to_thread(self._store, url, data)
+        except Exception as err:
+            media_logger.error('Ошибка обработки картинки %s: %r', url, err)
+            return None
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,72 @@
+"""Метрики бота в формате Prometheus.
+
+Эндпоинт поднимается в отдельном потоке: start_metrics_server(port).
+"""
+import time
+from functools import wraps
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+HANDLER_LATENCY = Histogram(
+    'bot_handler_seconds', 'Время обработки апдейта хендлером.', ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Исключения в хендлерах.', ['handler']
+)
+APOD_LATENCY = Histogram(
+    'apod_request_seconds', 'Время HTTP-запроса к APOD API.', ['status']
+)
+DB_LATENCY = Histogram(
+    'db_query_seconds', 'Время запроса к БД.', ['query']
+)
+DB_ERRORS = Counter(
+    'db_query_errors_total', 'Ошибки запросов к БД.', ['query']
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Обращения к кэшам (result: lru, db, stale, miss).', ['cache', 'result']
+)
+APOD_CIRCUIT_OPEN = Gauge(
+    'apod_circuit_open', '1, если запросы к APOD API приостановлены.'
+)
+
+
+def _timed(histogram, errors, name):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.labels(name).inc()
+                raise
+            finally:
+                histogram.labels(name).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def track_handler(handler):
+    """Латентность и ошибки хендлера."""
+    return _timed(HANDLER_LATENCY, HANDLER_ERRORS, handler.__name__)(handler)
+
+
+def track_query(query):
+    """Латентность и ошибки запроса к БД (метка - Класс.метод)."""
+    return _timed(DB_LATENCY, DB_ERRORS, query.__qualname__)(query)
+
+
+def observe_apod(status, seconds: float):
+    APOD_LATENCY.labels(str(status)).observe(seconds)
+
+
+def cache_lookup(cache: str, result: str):
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+def set_circuit_open(is_open: bool):
+    APOD_CIRCUIT_OPEN.set(int(is_open))
+
+
+def start_metrics_server(port: int, addr: str = '127.0.0.1'):
+    start_http_server(port, addr)
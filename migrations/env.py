@@ -1,13 +1,10 @@
 from logging.config import fileConfig
-from os import getenv
 
 from alembic import context
-from dotenv import load_dotenv
 from sqlalchemy import engine_from_config, pool
 
 from database import Base
-
-load_dotenv()
+from settings import DB_URL
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -27,20 +24,6 @@ target_metadata = [Base.metadata]
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
-DB_DIALECT  = getenv('DB_DIALECT')
-DB_HOSTNAME = getenv('DB_HOSTNAME')
-DB_USERNAME = getenv('POSTGRES_USER')
-DB_PASSWORD = getenv('POSTGRES_PASSWORD')
-DB_PORT     = getenv('DB_PORT')
-DB_DATABASE = getenv('DB_DATABASE')
-DB_URL = "%s://%s:%s@%s:%s/%s" % (
-    DB_DIALECT,
-    DB_USERNAME,
-    DB_PASSWORD,
-    DB_HOSTNAME,
-    DB_PORT,
-    DB_DATABASE
-)
 config.set_main_option('sqlalchemy.url', DB_URL)
 
 
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Set
+
+prefetch_logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Фоновая подгрузка в кэш дат, которые пользователь откроет следующими.
+
+    Одновременно выполняется не больше max_concurrency подгрузок. Новый
+    запрос пользователя отменяет его предыдущие подгрузки, ждущие очереди;
+    уже начатые доводятся до конца: запрос к APOD API всё равно завершится,
+    и его результат должен попасть в кэш.
+    """
+
+    def __init__(self, warm: Callable[[str], Awaitable], max_concurrency: int = 4):
+        self.warm = warm
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Dict[int, Set[asyncio.Task]] = {}
+        self._running: Set[asyncio.Task] = set()
+
+    def schedule(self, user_id: int, dates: Iterable[str]):
+        self.cancel(user_id)
+        tasks = {asyncio.create_task(self._run(date)) for date in dates if date}
+        if not tasks:
+            return
+        self._tasks[user_id] = tasks
+        for task in tasks:
+            task.add_done_callback(lambda task: self._done(user_id, task))
+
+    def cancel(self, user_id: int):
+        for task in self._tasks.pop(user_id, ()):
+            if task not in self._running:
+                task.cancel()
+
+    async def close(self):
+        tasks = {task for tasks in self._tasks.values() for task in tasks} | self._running
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, date: str):
+        async with self._semaphore:
+            task = asyncio.current_task()
+            self._running.add(task)
+            try:
+                await self.warm(date)
+            finally:
+                self._running.discard(task)
+            prefetch_logger.debug('Подгружено в кэш: %s.', date)
+
+    def _done(self, user_id: int, task: asyncio.Task):
+        tasks = self._tasks.get(user_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            prefetch_logger.error('Ошибка подгрузки: %r', task.exception())
@@ -0,0 +1,94 @@
+"""Настройки бота: переменные окружения (и .env) и константы."""
+import os
+from datetime import time, timedelta
+
+from dotenv import load_dotenv
+from pytz import timezone
+
+load_dotenv()
+
+ENDPOINT = os.getenv('NASA_API_URL', 'https://api.nasa.gov/planetary/apod')
+NASA_TOKEN = os.getenv('NASA_TOKEN')
+BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN_PROD')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL', 'https://api.telegram.org/file/bot')
+NASA_API_TZ = timezone('US/Eastern')
+MAX_CAPTION_SIZE = 1024
+MAX_MESSAGE_SIZE = 4096
+# full - описание целиком (подпись + сообщения), short - только подпись к фото.
+CAPTION_MODE = os.getenv('CAPTION_MODE', 'full')
+APOD_FIRST_DATE = '1995-06-16'
+APOD_ERROR_IMAGE_URL = 'http://lamcdn.net/lookatme.ru/post_image-image/sIaRmaFSMfrw8QJIBAa8mA-small.png'
+APOD_TODAY_TTL = timedelta(minutes=10)
+APOD_LRU_SIZE = 2048
+USER_STATE_LRU_SIZE = 10000
+# Состояние пользователя кэшируется в процессе: при нескольких репликах
+# стоит уменьшить, чтобы чужие изменения подхватывались быстрее.
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', 600))
+APOD_DAILY_JOB_TIME = time(0, 5, tzinfo=NASA_API_TZ)
+PREFETCH_CONCURRENCY = 4
+SEARCH_RESULTS_LIMIT = 10
+TOP_PICTURES_LIMIT = 10
+# Как часто пересчитывается статистика (материализованные представления).
+STATS_REFRESH_INTERVAL = timedelta(minutes=int(os.getenv('STATS_REFRESH_MINUTES', 15)))
+BROADCAST_TIME = time(9, 0, tzinfo=timezone('Europe/Moscow'))
+# Запас до глобального лимита Telegram (~30 сообщений/с) - для интерактивных ответов.
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+BROADCAST_BATCH_SIZE = 500
+
+# polling | webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 32))
+# Апдейты, принятые в обработку (в том числе ждущие своей очереди у пользователя).
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', 4096))
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# text | json (формат stdout; в файл всегда пишется JSON)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_FILE = os.getenv('LOG_FILE')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+
+DB_DIALECT  = os.getenv('DB_DIALECT')
+DB_ASYNC_DIALECT = os.getenv('DB_ASYNC_DIALECT', 'postgresql+asyncpg')
+DB_HOSTNAME = os.getenv('DB_HOSTNAME')
+DB_USERNAME = os.getenv('POSTGRES_USER')
+DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+DB_DATABASE = os.getenv('DB_DATABASE')
+DB_PORT = os.getenv('DB_PORT')
+DB_URL = "%s://%s:%s@%s:%s/%s" % (
+    DB_DIALECT,
+    DB_USERNAME,
+    DB_PASSWORD,
+    DB_HOSTNAME,
+    DB_PORT,
+    DB_DATABASE
+)
+DB_ASYNC_URL = "%s://%s:%s@%s:%s/%s" % (
+    DB_ASYNC_DIALECT,
+    DB_USERNAME,
+    DB_PASSWORD,
+    DB_HOSTNAME,
+    DB_PORT,
+    DB_DATABASE
+)
+# Каждый одновременно обрабатываемый апдейт может ждать соединение, поэтому
+# пул не меньше CONCURRENT_UPDATES; сверх него - фоновые задачи (отложенная
+# запись, advisory-блокировки задач по расписанию, догрузка архива).
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', CONCURRENT_UPDATES))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 8))
+# Проверка БД при старте: попыток и начальная задержка (удваивается), с.
+DB_CONNECT_RETRIES = int(os.getenv('DB_CONNECT_RETRIES', 5))
+DB_CONNECT_BACKOFF = float(os.getenv('DB_CONNECT_BACKOFF', 1.0))
+# Отложенная запись (избранное, активность): интервал сброса, с, и размер пачки.
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', 1.0))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 500))
+# Локальная копия картинок (media.py); пустое значение - отправка по url.
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR')
+MEDIA_MAX_SIDE = int(os.getenv('MEDIA_MAX_SIDE', 2560))
@@ -0,0 +1,47 @@
+"""Рассылка: картинка загружается в Telegram один раз."""
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import Forbidden
+
+import database as db
+from broadcast import LEFT, SENT, Broadcaster
+
+
+class StubBot:
+    def __init__(self, blocked):
+        self.blocked = blocked
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, caption, reply_markup=None):
+        self.sent.append((chat_id, photo))
+        if chat_id in self.blocked:
+            raise Forbidden('bot was blocked by the user')
+        return SimpleNamespace(photo=[SimpleNamespace(file_id='file-id')])
+
+
+def run_broadcast(monkeypatch, bot, chat_ids, **kwargs):
+    async def iter_subscribers(batch_size):
+        yield chat_ids
+
+    async def set_leave(chat_ids):
+        pass
+
+    monkeypatch.setattr(db.User, 'iter_subscribers', iter_subscribers)
+    monkeypatch.setattr(db.User, 'set_leave', set_leave)
+    broadcaster = Broadcaster(bot, b'jpeg', 'text', rate=1000, **kwargs)
+    return asyncio.run(broadcaster.run())
+
+
+def test_uploads_until_file_id(monkeypatch):
+    bot = StubBot(blocked={1, 2})
+    stats = run_broadcast(monkeypatch, bot, list(range(1, 11)))
+    uploads = [chat_id for chat_id, photo in bot.sent if photo == b'jpeg']
+    assert uploads == [1, 2, 3]
+    assert stats[LEFT] == 2 and stats[SENT] == 8
+
+
+def test_known_file_id_skips_upload(monkeypatch):
+    bot = StubBot(blocked=set())
+    run_broadcast(monkeypatch, bot, [1, 2, 3], file_id='cached')
+    assert {photo for _, photo in bot.sent} == {'cached'}
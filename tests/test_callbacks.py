@@ -0,0 +1,47 @@
+"""Формат callback_data."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import callbacks as cb
+from settings import NASA_API_TZ
+
+DAY = date(2004, 5, 16)
+
+
+@pytest.mark.parametrize('kind', sorted(cb.DATED))
+def test_roundtrip(kind):
+    data = cb.encode(kind, DAY)
+    assert len(data.encode()) <= 64
+    assert cb.decode(data) == (kind, DAY)
+
+
+def test_undated():
+    assert cb.encode(cb.MENU) == 'm'
+    assert cb.decode('m') == (cb.MENU, None)
+    assert cb.decode('t') == (cb.TOP, None)
+
+
+@pytest.mark.parametrize('data, expected', [
+    ('2004-05-16', (cb.DAY, DAY)),
+    ('fav: 2004-05-16', (cb.FAV, DAY)),
+    ('favs_add: 2004-05-16', (cb.FAV_ADD, DAY)),
+    ('menu', (cb.MENU, None)),
+])
+def test_legacy(data, expected):
+    assert cb.decode(data) == expected
+
+
+@pytest.mark.parametrize('data', [
+    '', 'd', 'd:', 'd:-1', 'd:1a', 'd:²', 'd:١٢', 'd:99999999', 'd:999999',
+    'dd:1', 'fav: 2004-02-30', 'fav: ２００４-05-16', 'fav:2004-05-16', 'menu ',
+    cb.encode(cb.DAY, cb.APOD_EPOCH - timedelta(days=1)),
+])
+def test_unrecognised(data):
+    assert cb.decode(data) == (None, None)
+
+
+def test_future_day_rejected():
+    today = datetime.now(tz=NASA_API_TZ).date()
+    assert cb.decode(cb.encode(cb.DAY, today)) == (cb.DAY, today)
+    assert cb.decode(cb.encode(cb.DAY, today + timedelta(days=1))) == (None, None)
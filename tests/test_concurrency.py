@@ -0,0 +1,54 @@
+"""Очередь апдейтов по пользователям."""
+import asyncio
+from types import SimpleNamespace
+
+from concurrency import UserLocks
+
+
+def make_update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+def test_user_queue_does_not_take_slots():
+    order = []
+
+    async def scenario():
+        locks = UserLocks(limit=2)
+        release = asyncio.Event()
+
+        @locks.serialize
+        async def handle(update, context):
+            order.append(update.effective_user.id)
+            if update.effective_user.id == 1:
+                await release.wait()
+
+        busy = [asyncio.create_task(handle(make_update(1), None)) for _ in range(10)]
+        await asyncio.sleep(0)
+        # Пока у пользователя 1 девять апдейтов в очереди, другой обслуживается сразу.
+        await asyncio.wait_for(handle(make_update(2), None), 1)
+        release.set()
+        await asyncio.gather(*busy)
+
+    asyncio.run(scenario())
+    assert order[:2] == [1, 2]
+    assert len(order) == 11
+
+
+def test_slots_bound_concurrency():
+    running, peak = 0, 0
+
+    async def scenario():
+        locks = UserLocks(limit=3)
+
+        @locks.serialize
+        async def handle(update, context):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(handle(make_update(user_id), None) for user_id in range(10)))
+
+    asyncio.run(scenario())
+    assert peak == 3
@@ -0,0 +1,35 @@
+"""Дисковый кэш картинок."""
+import io
+import os
+
+from PIL import Image
+
+from media import MediaStore
+
+URL = 'https://apod.nasa.gov/apod/image/test.jpg'
+
+
+def make_image(size=(64, 48)) -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', size, 'navy').save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_store_and_read(tmp_path):
+    store = MediaStore(str(tmp_path), max_side=32)
+    stored = store._store(URL, make_image())
+    assert stored is not None
+    assert store._read(URL) == stored
+    with Image.open(io.BytesIO(stored)) as image:
+        assert max(image.size) == 32
+
+
+def test_read_unavailable_object_returns_none(tmp_path):
+    store = MediaStore(str(tmp_path))
+    assert store._read(URL) is None
+    store._store(URL, make_image())
+    with open(store._index_path(URL)) as index:
+        path = store._object_path(index.read())
+    os.remove(path)
+    os.mkdir(path)
+    assert store._read(URL) is None
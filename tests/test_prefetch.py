@@ -0,0 +1,25 @@
+"""Фоновая подгрузка соседних дат."""
+import asyncio
+
+from prefetch import Prefetcher
+
+
+def test_reschedule_keeps_started_and_drops_queued():
+    warmed = []
+
+    async def warm(date):
+        await asyncio.sleep(0.01)
+        warmed.append(date)
+
+    async def scenario():
+        prefetcher = Prefetcher(warm, max_concurrency=1)
+        prefetcher.schedule(1, ['2020-01-01', '2020-01-02', '2020-01-03'])
+        await asyncio.sleep(0)
+        prefetcher.schedule(1, ['2020-01-04'])
+        await asyncio.sleep(0.05)
+        await prefetcher.close()
+
+    asyncio.run(scenario())
+    # Начатая подгрузка доведена до кэша, ждавшие очереди отменены.
+    assert len(warmed) == 2
+    assert warmed[-1] == '2020-01-04'
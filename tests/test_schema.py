@@ -0,0 +1,30 @@
+"""Импорт модулей и согласованность схемы БД без подключения к Postgres."""
+import os
+
+import pytest
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import database as db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bot_imports():
+    import bot  # noqa: F401
+
+
+@pytest.mark.parametrize('table', list(db.metadata.sorted_tables), ids=lambda table: table.name)
+def test_table_compiles(table):
+    dialect = postgresql.dialect()
+    CreateTable(table).compile(dialect=dialect)
+    for index in table.indexes:
+        CreateIndex(index).compile(dialect=dialect)
+
+
+def test_migrations_single_head():
+    config = Config(os.path.join(ROOT, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(ROOT, 'migrations'))
+    assert len(ScriptDirectory.from_config(config).get_heads()) == 1
@@ -0,0 +1,47 @@
+"""Очередь отложенной записи без БД: сохранение подменяется."""
+import asyncio
+import datetime
+
+import database as db
+
+
+def test_close_waits_for_running_flush():
+    written = []
+    started = asyncio.Event()
+
+    async def slow_save(favs):
+        started.set()
+        await asyncio.sleep(0.05)
+        written.extend(favs)
+
+    async def scenario():
+        queue = db.WriteBehind(interval=0.01)
+        queue._save_favs = slow_save
+        queue.add_favorite(1, datetime.date(2020, 1, 1))
+        await started.wait()
+        queue.add_favorite(2, datetime.date(2020, 1, 2))
+        await queue.close()
+
+    asyncio.run(scenario())
+    assert sorted(written) == [(1, datetime.date(2020, 1, 1)), (2, datetime.date(2020, 1, 2))]
+
+
+def test_run_survives_unexpected_error():
+    calls = []
+
+    async def flaky_save(favs):
+        calls.append(list(favs))
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+
+    async def scenario():
+        queue = db.WriteBehind(interval=0.01)
+        queue._save_favs = flaky_save
+        queue.add_favorite(1, datetime.date(2020, 1, 1))
+        await asyncio.sleep(0.05)
+        assert not queue._task.done()
+        await queue.close()
+
+    asyncio.run(scenario())
+    assert calls[-1] == [(1, datetime.date(2020, 1, 1))]
+    assert len(calls) == 2